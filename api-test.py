@@ -6,6 +6,7 @@ import requests
 import sys
 import os
 from pathlib import Path
+from generation_cache import GenerationCache
 
 API_ENDPOINT = "https://moulik-budhiraja--shape-text-to-3d-a100-40gb-generate.modal.run"
 
@@ -15,9 +16,10 @@ GUIDANCE_SCALE = 15.0
 NUM_STEPS = 64
 SEED = None  # Set to an integer if you want a specific seed
 OUTPUT_FILE = None  # Will be auto-generated based on prompt if None
+USE_CACHE = True  # Reuse earlier results of seeded requests with the same parameters
 
 
-def generate_3d_model(prompt, guidance_scale=15.0, num_steps=64, seed=None, output_file=None) -> bool:
+def generate_3d_model(prompt, guidance_scale=15.0, num_steps=64, seed=None, output_file=None, cache=None) -> bool:
     """
     Generate a 3D model from a text prompt by calling the deployed Modal app.
 
@@ -27,6 +29,7 @@ def generate_3d_model(prompt, guidance_scale=15.0, num_steps=64, seed=None, outp
         num_steps (int): Number of diffusion steps
         seed (int, optional): Random seed for reproducibility
         output_file (str, optional): Path to save the output STL file
+        cache (GenerationCache, optional): Cache consulted for seeded requests
 
     Returns:
         bool: True if generation was successful, False otherwise
@@ -51,6 +54,12 @@ def generate_3d_model(prompt, guidance_scale=15.0, num_steps=64, seed=None, outp
         safe_prompt = safe_prompt[:30]  # Limit length
         output_file = f"{safe_prompt}.stl"
 
+    # Seeded generations are deterministic, so an identical earlier request can be reused
+    cache_key = cache.key(prompt, guidance_scale, num_steps, seed, API_ENDPOINT) if cache is not None else None
+    if cache_key is not None and cache.fetch(cache_key, output_file):
+        print(f"Loaded cached 3D model into {output_file}")
+        return True
+
     print(f"Sending request to {API_ENDPOINT}")
     try:
         # Send POST request to the API
@@ -78,6 +87,9 @@ def generate_3d_model(prompt, guidance_scale=15.0, num_steps=64, seed=None, outp
             file_size = os.path.getsize(output_file)
             print(f"File size: {file_size / 1024:.1f} KB")
 
+            if cache_key is not None:
+                cache.store(cache_key, output_file)
+
             return True
         else:
             print(f"Error: Received status code {response.status_code}")
@@ -101,7 +113,8 @@ if __name__ == "__main__":
         guidance_scale=GUIDANCE_SCALE,
         num_steps=NUM_STEPS,
         seed=SEED,
-        output_file=OUTPUT_FILE
+        output_file=OUTPUT_FILE,
+        cache=GenerationCache() if USE_CACHE else None
     )
 
     if not success:
@@ -6,6 +6,20 @@ const util = require("util")
 const exec = util.promisify(require("child_process").exec)
 const os = require("os")
 
+// Exit code of obj_to_ldr.py when it stops at its deadline or on cancellation (job_control.py)
+const CONVERTER_TIMEOUT_EXIT_CODE = 3
+// Extra time past the deadline before a converter that didn't stop is killed
+const CONVERTER_KILL_GRACE_SECONDS = 30
+
+// Error codes of conversions stopped by their deadline or by the caller; these are
+// reported as errors instead of being replaced with a placeholder model
+const CONVERSION_TIMEOUT = "ETIMEDOUT"
+const CONVERSION_ABORTED = "ABORT_ERR"
+
+function isConversionStopped(error) {
+  return error.code === CONVERSION_TIMEOUT || error.code === CONVERSION_ABORTED
+}
+
 class ModelToLDR {
   constructor() {
     this.outputDir = path.join(__dirname, "ldr_output")
@@ -52,8 +66,9 @@ class ModelToLDR {
     const fileExt = path.extname(modelPath).toLowerCase()
     console.log(`File extension: ${fileExt}`)
 
-    // Check if the file is an OBJ, STL, or GLB
-    if (fileExt === ".obj") {
+    // Check if the file is an OBJ, STL, GLB or a precomputed voxel grid
+    if (fileExt === ".obj" || fileExt === ".binvox" || fileExt === ".npz") {
+      // obj_to_ldr.py reads .binvox/.npz grids directly and skips voxelization
       return await this.convertOBJToLDR(modelPath, options)
     } else if (fileExt === ".stl") {
       console.log("STL file detected. Attempting to convert to OBJ first...")
@@ -84,13 +99,16 @@ print('Conversion successful')
           throw new Error("STL to OBJ conversion failed: Output file not created")
         }
       } catch (error) {
+        if (isConversionStopped(error)) {
+          throw error
+        }
         console.error("STL to OBJ conversion error:", error)
         throw new Error(`Failed to convert STL to OBJ: ${error.message}`)
       }
     } else if (fileExt === ".glb") {
       throw new Error("GLB to LDR conversion is not implemented yet. This is a placeholder for future functionality.")
     } else {
-      throw new Error(`Unsupported file format: ${fileExt}. Only OBJ and STL files are supported.`)
+      throw new Error(`Unsupported file format: ${fileExt}. Only OBJ, STL, BINVOX and NPZ files are supported.`)
     }
   }
 
@@ -99,6 +117,13 @@ print('Conversion successful')
    * @param {string} objPath - Path to the OBJ file
    * @param {Object} options - Conversion options
    * @param {number} options.resolution - Voxel resolution (default: 64)
+   * @param {Function} [options.onProgress] - Called with each progress event from the converter
+   * @param {number} [options.timeBudget] - Seconds; lowers the resolution to the highest one estimated to fit
+   * @param {number} [options.memoryBudget] - MB; lowers the resolution to the highest one estimated to fit
+   * @param {number} [options.deadline] - Seconds the conversion may take; a partial model is kept at the deadline
+   * @param {AbortSignal} [options.signal] - Cancels the conversion when aborted
+   * @param {boolean} [options.savePlan] - Keep a per-layer plan next to the LDR for later incremental conversions
+   * @param {string} [options.previousLdrPath] - Earlier LDR saved with savePlan; only its changed layers are re-placed
    * @returns {Promise<Object>} - Object containing the path to the LDR file and other metadata
    */
   async convertOBJToLDR(objPath, options = {}) {
@@ -135,10 +160,26 @@ print('Conversion successful')
       console.log(`Input file: ${objPath}`)
       console.log(`Output file: ${outputLdrPath}`)
       
-      const command = `${this.pythonPath} "${this.objToLdrPath}" "${objPath}" "${outputLdrPath}" ${resolution}`
-      console.log(`Executing command: ${command}`)
+      const args = [this.objToLdrPath, objPath, outputLdrPath, String(resolution)]
+      // With a budget, resolution is the upper bound of the converter's estimate-based choice
+      if (options.timeBudget) {
+        args.push("--time-budget", String(options.timeBudget))
+      }
+      if (options.memoryBudget) {
+        args.push("--memory-budget", String(options.memoryBudget))
+      }
+      if (options.deadline) {
+        args.push("--deadline", String(options.deadline))
+      }
+      if (options.savePlan) {
+        args.push("--save-plan")
+      }
+      if (options.previousLdrPath) {
+        args.push("--incremental", options.previousLdrPath)
+      }
+      console.log(`Executing command: ${this.pythonPath} ${args.join(" ")}`)
       
-      const { stdout, stderr } = await exec(command)
+      const { stdout, stderr } = await this.runConverter(args, options.onProgress, options)
       console.log("Python script output:", stdout)
       if (stderr) {
         console.error("Python script error:", stderr)
@@ -160,6 +201,10 @@ print('Conversion successful')
         fileSize,
       }
     } catch (error) {
+      if (isConversionStopped(error)) {
+        // A timed-out or cancelled job must not look like a success or leave a file behind
+        throw error
+      }
       console.error("Error converting OBJ to LDR:", error)
 
       // If conversion fails, generate a placeholder LDR file
@@ -180,6 +225,95 @@ print('Conversion successful')
     }
   }
 
+  /**
+   * Run obj_to_ldr.py, forwarding its JSON-lines progress events (written to
+   * file descriptor 3) to onProgress
+   * @param {string[]} args - Script path and arguments
+   * @param {Function} [onProgress] - Called with each parsed progress event
+   * @param {Object} [limits] - Job limits
+   * @param {number} [limits.deadline] - Seconds the script was given with --deadline
+   * @param {AbortSignal} [limits.signal] - Sends SIGTERM, which the script handles as a cancellation
+   * @returns {Promise<Object>} - The script's stdout and stderr
+   */
+  runConverter(args, onProgress, { deadline, signal } = {}) {
+    // Extra inherited pipes aren't usable file descriptors for Python on Windows
+    const withProgress = typeof onProgress === "function" && process.platform !== "win32"
+    const stdio = withProgress ? ["ignore", "pipe", "pipe", "pipe"] : ["ignore", "pipe", "pipe"]
+    const child = spawn(this.pythonPath, withProgress ? [...args, "--progress-fd", "3"] : args, { stdio, signal })
+
+    // The script stops itself at the deadline; kill it if a stage can't be interrupted
+    const killTimer = deadline
+      ? setTimeout(() => child.kill("SIGKILL"), (deadline + CONVERTER_KILL_GRACE_SECONDS) * 1000)
+      : null
+    // A cancelled script gets the same grace period to wind down before it is killed
+    let abortTimer = null
+    const onAbort = () => {
+      abortTimer = setTimeout(() => child.kill("SIGKILL"), CONVERTER_KILL_GRACE_SECONDS * 1000)
+    }
+    if (signal) {
+      signal.addEventListener("abort", onAbort, { once: true })
+    }
+    const clearTimers = () => {
+      clearTimeout(killTimer)
+      clearTimeout(abortTimer)
+      if (signal) {
+        signal.removeEventListener("abort", onAbort)
+      }
+    }
+
+    let stdout = ""
+    let stderr = ""
+    child.stdout.on("data", (data) => (stdout += data))
+    child.stderr.on("data", (data) => (stderr += data))
+
+    if (withProgress) {
+      let pending = ""
+      child.stdio[3].on("data", (data) => {
+        const lines = (pending + data).split("\n")
+        pending = lines.pop()
+        for (const line of lines) {
+          if (!line.trim()) continue
+          let event
+          try {
+            event = JSON.parse(line)
+          } catch (error) {
+            console.warn("Ignoring malformed progress event:", line)
+            continue
+          }
+          // Errors thrown by the callback are the caller's, not a malformed event
+          onProgress(event)
+        }
+      })
+    }
+
+    return new Promise((resolve, reject) => {
+      child.on("error", (error) => {
+        // An abort is reported here right away; keep the kill timer until the script exits
+        if (error.name !== "AbortError") {
+          clearTimers()
+        }
+        reject(error)
+      })
+      child.on("close", (code, signalName) => {
+        clearTimers()
+        if (code === 0) {
+          resolve({ stdout, stderr })
+        } else if (code === CONVERTER_TIMEOUT_EXIT_CODE || signalName === "SIGKILL") {
+          const error = new Error("LDR conversion timed out or was cancelled")
+          error.code = signal && signal.aborted ? CONVERSION_ABORTED : CONVERSION_TIMEOUT
+          error.stdout = stdout
+          error.stderr = stderr
+          reject(error)
+        } else {
+          const error = new Error(`obj_to_ldr.py exited with code ${code}`)
+          error.stdout = stdout
+          error.stderr = stderr
+          reject(error)
+        }
+      })
+    })
+  }
+
   /**
    * Generate a placeholder LDR file with a simple brick
    * @param {string} modelId - Unique ID for the model
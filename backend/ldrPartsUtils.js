@@ -1,6 +1,7 @@
 // ldrPartsUtils.js
 const fs = require("fs")
 const path = require("path")
+const zlib = require("zlib")
 
 // Parse an LDR file to count parts and return the part list
 const parseLDR = (filePath) => {
@@ -92,9 +93,39 @@ const getLDrawColors = () => {
   }
 }
 
+// Decode the binary layer container written by `ldr_parser.py --format binary`.
+// Columns are returned as typed array views on the body, so uncompressed
+// output is not copied when the body is already 8-byte aligned.
+const TYPED_ARRAYS = { uint32: Uint32Array, int32: Int32Array, float32: Float32Array }
+
+const decodeLayerBinary = (buffer) => {
+  if (buffer.toString("latin1", 0, 4) !== "LDRB") {
+    throw new Error("Not an LDR binary layer container")
+  }
+  const flags = buffer.readUInt16LE(6)
+  const headerLength = buffer.readUInt32LE(8)
+  const header = JSON.parse(buffer.toString("utf-8", 12, 12 + headerLength))
+
+  let body = buffer.subarray(12 + headerLength)
+  if (flags & 1) {
+    body = zlib.inflateSync(body)
+  }
+  if (body.byteOffset % 8 !== 0) {
+    body = Buffer.from(body)
+  }
+
+  const columns = {}
+  header.columns.forEach(({ name, dtype, offset, length }) => {
+    columns[name] = new TYPED_ARRAYS[dtype](body.buffer, body.byteOffset + offset, length)
+  })
+
+  return { ...header, columns }
+}
+
 module.exports = {
   parseLDR,
   makeLDRparse,
   getLDrawColors,
+  decodeLayerBinary,
 }
 
@@ -3,72 +3,210 @@
 import sys
 import os
 import json
-from collections import defaultdict
+import re
+import struct
+import zlib
+from array import array
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
+
+# Rough per-part cost of the LdrPart records stored in parts_by_layer, used to
+# keep LdrModelCache within its memory bound without walking every object.
+PART_RECORD_BYTES = 200
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+# Compact binary layout written by encode_binary():
+#   magic 'LDRB' | uint16 version | uint16 flags | uint32 header length
+#   JSON header (padded with spaces to an 8-byte boundary)
+#   body: little-endian column arrays, each starting on an 8-byte boundary,
+#         zlib-compressed as a whole when FLAG_ZLIB is set
+BINARY_MAGIC = b'LDRB'
+BINARY_VERSION = 1
+FLAG_ZLIB = 1
+_BINARY_PREFIX = struct.Struct('<4sHHI')
+
+BRICK_HEIGHT_LDU = 24
+INHERIT_COLOR = 16
+
+# Part geometry: part number -> (width, depth) in studs and height in bricks.
+# Covers every part obj_to_ldr.py can emit plus the common LDraw bricks,
+# plates and tiles.
+BRICK = 1
+PLATE = 0.33
+PART_DIMENSIONS = {
+    # Bricks
+    '3005': (1, 1, BRICK), '3004': (1, 2, BRICK), '3622': (1, 3, BRICK),
+    '3010': (1, 4, BRICK), '3009': (1, 6, BRICK), '3008': (1, 8, BRICK),
+    '6111': (1, 10, BRICK), '6112': (1, 12, BRICK), '2465': (1, 16, BRICK),
+    '3003': (2, 2, BRICK), '3002': (2, 3, BRICK), '3001': (2, 4, BRICK),
+    '2456': (2, 6, BRICK), '3007': (2, 8, BRICK), '3006': (2, 10, BRICK),
+    '2356': (4, 6, BRICK), '6212': (4, 10, BRICK),
+    # Plates
+    '3024': (1, 1, PLATE), '3023': (1, 2, PLATE), '3623': (1, 3, PLATE),
+    '3710': (1, 4, PLATE), '3666': (1, 6, PLATE), '3460': (1, 8, PLATE),
+    '4477': (1, 10, PLATE), '60479': (1, 12, PLATE),
+    '3022': (2, 2, PLATE), '3021': (2, 3, PLATE), '3020': (2, 4, PLATE),
+    '3795': (2, 6, PLATE), '3034': (2, 8, PLATE), '3832': (2, 10, PLATE),
+    '2445': (2, 12, PLATE), '91988': (2, 14, PLATE), '4282': (2, 16, PLATE),
+    '3031': (4, 4, PLATE), '3032': (4, 6, PLATE), '3035': (4, 8, PLATE),
+    '3030': (4, 10, PLATE), '3029': (4, 12, PLATE),
+    '3958': (6, 6, PLATE), '3036': (6, 8, PLATE), '3033': (6, 10, PLATE),
+    '3028': (6, 12, PLATE), '3456': (6, 14, PLATE), '3027': (6, 16, PLATE),
+    '41539': (8, 8, PLATE), '92438': (8, 16, PLATE),
+    # Tiles
+    '3070b': (1, 1, PLATE), '3069b': (1, 2, PLATE), '63864': (1, 3, PLATE),
+    '2431': (1, 4, PLATE), '6636': (1, 6, PLATE), '4162': (1, 8, PLATE),
+    '3068b': (2, 2, PLATE), '87079': (2, 4, PLATE),
+}
+DEFAULT_DIMENSIONS = {'width': 1, 'height': 0.5, 'depth': 1}
+_PART_NUMBER = re.compile(r'(\d+)([a-z]?)')
+
+def _normalize_part_name(part_name):
+    """'parts\\3001.DAT' -> '3001', the key used by PART_DIMENSIONS."""
+    name = part_name.strip().replace('\\', '/').rsplit('/', 1)[-1].lower()
+    if name.endswith('.dat'):
+        name = name[:-4]
+    return sys.intern(name)
+
+@lru_cache(maxsize=None)
+def lookup_part_dimensions(part_name):
+    """
+    Return {'width', 'height', 'depth'} for a part name.
+    
+    Lookups are memoized per distinct name, and every part with the same name
+    shares the returned dict, so callers must not modify it.
+    """
+    key = _normalize_part_name(part_name)
+    entry = PART_DIMENSIONS.get(key)
+    if entry is None:
+        # Variants and prints such as 3070 or 3068bpx1 share the base geometry
+        match = _PART_NUMBER.match(key)
+        if match:
+            number, suffix = match.groups()
+            for candidate in (number + suffix, number, number + 'b'):
+                entry = PART_DIMENSIONS.get(candidate)
+                if entry is not None:
+                    break
+    if entry is None:
+        return DEFAULT_DIMENSIONS
+    width, depth, height = entry
+    return {'width': width, 'height': height, 'depth': depth}
+
+def _compose(color, position, matrix, child):
+    """Place a child part (color, position, matrix, name) under a parent transform."""
+    child_color, (cx, cy, cz), m, part_name = child
+    a, b, c, d, e, f, g, h, i = matrix
+    world_position = (
+        position[0] + a * cx + b * cy + c * cz,
+        position[1] + d * cx + e * cy + f * cz,
+        position[2] + g * cx + h * cy + i * cz,
+    )
+    world_matrix = (
+        a * m[0] + b * m[3] + c * m[6], a * m[1] + b * m[4] + c * m[7], a * m[2] + b * m[5] + c * m[8],
+        d * m[0] + e * m[3] + f * m[6], d * m[1] + e * m[4] + f * m[7], d * m[2] + e * m[5] + f * m[8],
+        g * m[0] + h * m[3] + i * m[6], g * m[1] + h * m[4] + i * m[7], g * m[2] + h * m[5] + i * m[8],
+    )
+    # Color 16 means "inherit the color of the referencing line"
+    if child_color == INHERIT_COLOR:
+        child_color = color
+    return child_color, world_position, world_matrix, part_name
+
+def _format_number(value):
+    return str(int(value)) if value.is_integer() else repr(value)
+
+def _format_part_line(color, position, matrix, part_name):
+    numbers = ' '.join(_format_number(value) for value in position + matrix)
+    return f"1 {color} {numbers} {part_name}"
+
+class LdrPart:
+    """
+    Compact record for one placed part.
+    
+    Records are what parts_by_layer stores; to_dict() is the JSON projection
+    and is only applied at the output boundary (see dumps_layers).
+    """
+    __slots__ = ('color', 'x', 'y', 'z', 'matrix', 'part_name')
+    
+    def __init__(self, color, x, y, z, matrix, part_name):
+        self.color = color
+        self.x = x
+        self.y = y
+        self.z = z
+        self.matrix = matrix
+        self.part_name = part_name
+    
+    @property
+    def line(self):
+        return _format_part_line(self.color, (self.x, self.y, self.z), self.matrix, self.part_name)
+    
+    @property
+    def dimensions(self):
+        return lookup_part_dimensions(self.part_name)
+    
+    def to_dict(self):
+        return {
+            'line': self.line,
+            'color': self.color,
+            'position': {'x': self.x, 'y': self.y, 'z': self.z},
+            'matrix': list(self.matrix),
+            'partName': self.part_name,
+            'dimensions': self.dimensions
+        }
+
+def _json_default(value):
+    if isinstance(value, LdrPart):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps_layers(layers_data):
+    """Serialize get_layers_data()/get_layers_up_to() output, projecting parts to dicts."""
+    return json.dumps(layers_data, default=_json_default)
 
 class LdrParser:
     """Parser for LDR files that extracts layer information."""
     
     def __init__(self, file_path):
         self.file_path = file_path
-        self.lines = []
         self.max_layer = 0
         self.parts_by_layer = defaultdict(list)
         self.materials = {}
         self.current_color = 0
+        self._layers = None
     
     def parse(self):
-        """Parse the LDR file and extract layer information."""
+        """
+        Parse the LDR file and extract layer information.
+        
+        Multi-part documents (.mpd) are supported: the first '0 FILE' section
+        is the main model and type 1 references to other sections are expanded
+        with their transforms composed onto the referencing line.
+        """
         try:
+            # The raw lines are only needed until they are split into sections
             with open(self.file_path, 'r', encoding='utf-8') as file:
-                self.lines = file.readlines()
+                main_model = self._split_subfiles(file)
             
-            for line in self.lines:
-                line = line.strip()
-                if not line or line.startswith('0 '):  # Skip empty lines and comments
-                    continue
+            # Parts share matrix tuples; most bricks use one of a few rotations
+            matrices = {}
+            for color, position, matrix, part_name in self._expand_model(main_model):
+                x_pos, y_pos, z_pos = position
+                
+                # Determine layer based on Y position (LDraw -Y points up)
+                layer = int(round(-y_pos / BRICK_HEIGHT_LDU))
+                
+                # Ensure layer is at least 0
+                layer = max(0, layer)
+                
+                # Update max layer
+                self.max_layer = max(self.max_layer, layer)
                 
-                if line.startswith('1 '):  # Line type 1 represents parts
-                    parts = line.split()
-                    if len(parts) >= 14:  # Valid part line has at least 14 elements
-                        color = int(parts[1])
-                        # Extract position (Y coordinate determines the layer)
-                        y_pos = float(parts[5])
-                        
-                        # Extract part filename
-                        part_name = parts[14]
-                        
-                        # Extract position
-                        x_pos = float(parts[2])
-                        z_pos = float(parts[6])
-                        
-                        # Extract rotation matrix
-                        matrix = [
-                            float(parts[5]), float(parts[6]), float(parts[7]),
-                            float(parts[8]), float(parts[9]), float(parts[10]),
-                            float(parts[11]), float(parts[12]), float(parts[13])
-                        ]
-                        
-                        # Determine layer based on Y position (higher Y = higher layer)
-                        layer = int(y_pos / 24)  # Assuming 24 LDU units per layer
-                        
-                        # Ensure layer is at least 0
-                        layer = max(0, layer)
-                        
-                        # Update max layer
-                        self.max_layer = max(self.max_layer, layer)
-                        
-                        # Determine brick dimensions based on part name (simplified)
-                        dimensions = self.get_brick_dimensions(part_name)
-                        
-                        # Store part information by layer
-                        self.parts_by_layer[layer].append({
-                            'line': line,
-                            'color': color,
-                            'position': {'x': x_pos, 'y': y_pos, 'z': z_pos},
-                            'matrix': matrix,
-                            'partName': part_name,
-                            'dimensions': dimensions
-                        })
+                # Store part information by layer
+                matrix = matrices.setdefault(matrix, matrix)
+                self.parts_by_layer[layer].append(
+                    LdrPart(color, x_pos, y_pos, z_pos, matrix, part_name))
+            
+            # The section tables are only needed while expanding
+            self.subfiles = self._references = self._flattened = None
             
             # Add 1 to max_layer to make it 1-indexed
             self.max_layer += 1
@@ -78,58 +216,131 @@ class LdrParser:
             print(f"Error parsing LDR file: {e}", file=sys.stderr)
             return False
     
-    def get_brick_dimensions(self, part_name):
+    def _split_subfiles(self, lines):
         """
-        Get brick dimensions based on part name.
-        This is a simplified method that uses common brick naming patterns.
-        In a full implementation, this would use a database of brick definitions.
+        Split the raw lines into '0 FILE' sections.
+        
+        Returns the key of the main model. A plain LDR file without FILE
+        meta commands becomes a single unnamed section.
         """
-        # Default dimensions
-        dimensions = {'width': 1, 'height': 0.5, 'depth': 1}
+        self.subfiles = {}
+        self._references = {}
+        self._flattened = {}
+        main_model = None
+        current = None
         
-        # Extract brick size from common naming patterns
-        if '3001.dat' in part_name:  # 2x4 brick
-            dimensions = {'width': 2, 'height': 1, 'depth': 4}
-        elif '3003.dat' in part_name:  # 2x2 brick
-            dimensions = {'width': 2, 'height': 1, 'depth': 2}
-        elif '3004.dat' in part_name:  # 1x2 brick
-            dimensions = {'width': 1, 'height': 1, 'depth': 2}
-        elif '3005.dat' in part_name:  # 1x1 brick
-            dimensions = {'width': 1, 'height': 1, 'depth': 1}
-        elif '3010.dat' in part_name:  # 1x4 brick
-            dimensions = {'width': 1, 'height': 1, 'depth': 4}
-        elif '3020.dat' in part_name:  # 2x4 plate
-            dimensions = {'width': 2, 'height': 0.33, 'depth': 4}
-        elif '3022.dat' in part_name:  # 2x2 plate
-            dimensions = {'width': 2, 'height': 0.33, 'depth': 2}
-        elif '3023.dat' in part_name:  # 1x2 plate
-            dimensions = {'width': 1, 'height': 0.33, 'depth': 2}
-        elif '3024.dat' in part_name:  # 1x1 plate
-            dimensions = {'width': 1, 'height': 0.33, 'depth': 1}
+        for line in lines:
+            line = line.strip()
+            if line.startswith('0 FILE '):
+                current = line[7:].strip().lower()
+                self.subfiles[current] = []
+                if main_model is None:
+                    main_model = current
+            elif line == '0 NOFILE':
+                current = None
+            elif current is not None:
+                self.subfiles[current].append(line)
+            elif main_model is None:
+                self.subfiles.setdefault('', []).append(line)
         
-        return dimensions
+        if main_model is None:
+            main_model = ''
+            self.subfiles.setdefault('', [])
+        return main_model
     
-    def get_layers_data(self):
-        """Get all layers data."""
-        layers = []
+    def _parse_references(self, model):
+        """Parse the type 1 lines of a section once and memoize them."""
+        references = self._references.get(model)
+        if references is None:
+            references = []
+            for line in self.subfiles[model]:
+                if not line.startswith('1 '):  # Line type 1 represents parts
+                    continue
+                parts = line.split()
+                if len(parts) < 15:  # Valid part line has at least 15 elements
+                    continue
+                color = int(parts[1])
+                position = (float(parts[2]), float(parts[3]), float(parts[4]))
+                matrix = tuple(float(value) for value in parts[5:14])
+                part_name = sys.intern(' '.join(parts[14:]))
+                key = part_name.lower()
+                references.append((color, position, matrix, part_name,
+                                   key if key in self.subfiles else None))
+            self._references[model] = references
+        return references
+    
+    def _flatten_subfile(self, model, expanding=()):
+        """
+        Return the leaf parts of a submodel in its own coordinate system.
         
-        for layer_num in range(self.max_layer):
-            layer_parts = self.parts_by_layer.get(layer_num, [])
-            
-            # Count brick types
-            brick_counts = defaultdict(int)
-            for part in layer_parts:
-                brick_counts[part['partName']] += 1
-            
-            layers.append({
-                'layer': layer_num,
-                'parts': layer_parts,
-                'partsCount': len(layer_parts),
-                'brickCounts': dict(brick_counts)
-            })
+        The result is computed once per submodel and shared by every instance,
+        so repeated assemblies cost one transform per leaf part and instance.
+        """
+        flattened = self._flattened.get(model)
+        if flattened is not None:
+            return flattened
         
+        flattened = []
+        expanding = expanding + (model,)
+        for color, position, matrix, part_name, subfile in self._parse_references(model):
+            if subfile is None:
+                flattened.append((color, position, matrix, part_name))
+            elif subfile in expanding:
+                print(f"Skipping recursive reference to {part_name}", file=sys.stderr)
+            else:
+                for child in self._flatten_subfile(subfile, expanding):
+                    flattened.append(_compose(color, position, matrix, child))
+        self._flattened[model] = flattened
+        return flattened
+    
+    def _expand_model(self, model):
+        """
+        Lazily yield (color, position, matrix, part name) for every part of
+        the model, expanding submodel references in place.
+        """
+        for color, position, matrix, part_name, subfile in self._parse_references(model):
+            if subfile is None:
+                yield color, position, matrix, part_name
+            elif subfile == model:
+                print(f"Skipping recursive reference to {part_name}", file=sys.stderr)
+            else:
+                for child in self._flatten_subfile(subfile, (model,)):
+                    yield _compose(color, position, matrix, child)
+    
+    def get_brick_dimensions(self, part_name):
+        """Get brick dimensions for a part name from PART_DIMENSIONS."""
+        return lookup_part_dimensions(part_name)
+    
+    def estimated_size(self):
+        """Approximate number of bytes held by the parsed model."""
+        part_count = sum(len(parts) for parts in self.parts_by_layer.values())
+        return part_count * PART_RECORD_BYTES
+    
+    def _get_layers(self):
+        """Build the per-layer summaries once and reuse them for every query."""
+        if self._layers is None:
+            layers = []
+            for layer_num in range(self.max_layer):
+                layer_parts = self.parts_by_layer.get(layer_num, [])
+                
+                # Count brick types
+                brick_counts = defaultdict(int)
+                for part in layer_parts:
+                    brick_counts[part.part_name] += 1
+                
+                layers.append({
+                    'layer': layer_num,
+                    'parts': layer_parts,
+                    'partsCount': len(layer_parts),
+                    'brickCounts': dict(brick_counts)
+                })
+            self._layers = layers
+        return self._layers
+    
+    def get_layers_data(self):
+        """Get all layers data."""
         return {
-            'layers': layers,
+            'layers': self._get_layers(),
             'maxLayer': self.max_layer
         }
     
@@ -138,36 +349,219 @@ class LdrParser:
         if layer_num < 0 or layer_num >= self.max_layer:
             layer_num = self.max_layer - 1
         
-        layers = []
-        
-        for i in range(layer_num + 1):
-            layer_parts = self.parts_by_layer.get(i, [])
-            
-            # Count brick types
-            brick_counts = defaultdict(int)
-            for part in layer_parts:
-                brick_counts[part['partName']] += 1
-            
-            layers.append({
-                'layer': i,
-                'parts': layer_parts,
-                'partsCount': len(layer_parts),
-                'brickCounts': dict(brick_counts)
-            })
-        
         return {
-            'layers': layers,
+            'layers': self._get_layers()[:layer_num + 1],
             'layer_num': layer_num,
             'max_layer': self.max_layer
         }
 
+class LdrModelCache:
+    """
+    In-process LRU cache of parsed LDR models.
+    
+    Entries are keyed by (absolute path, mtime, size) so an edited file is
+    parsed again on its next request, and the total estimated size of the
+    cached models is kept under max_bytes.
+    """
+    
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._keys_by_path = {}
+    
+    def _key(self, file_path):
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        return (path, stat.st_mtime_ns, stat.st_size)
+    
+    def _evict(self, key):
+        _, size = self._entries.pop(key)
+        self.current_bytes -= size
+        if self._keys_by_path.get(key[0]) == key:
+            del self._keys_by_path[key[0]]
+    
+    def get(self, file_path):
+        """Return a parsed LdrParser for file_path, or None if parsing fails."""
+        key = self._key(file_path)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        
+        self.misses += 1
+        parser = LdrParser(key[0])
+        if not parser.parse():
+            return None
+        
+        # Drop the entry for an older version of the same file
+        stale_key = self._keys_by_path.get(key[0])
+        if stale_key is not None:
+            self._evict(stale_key)
+        
+        size = parser.estimated_size()
+        self._entries[key] = (parser, size)
+        self._keys_by_path[key[0]] = key
+        self.current_bytes += size
+        
+        # Evict least recently used models, but always keep the newest one
+        while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+            self._evict(next(iter(self._entries)))
+        
+        return parser
+    
+    def get_layers_data(self, file_path):
+        parser = self.get(file_path)
+        return parser.get_layers_data() if parser else None
+    
+    def get_layers_up_to(self, file_path, layer_num):
+        parser = self.get(file_path)
+        return parser.get_layers_up_to(layer_num) if parser else None
+    
+    def clear(self):
+        self._entries.clear()
+        self._keys_by_path.clear()
+        self.current_bytes = 0
+
+def _pad8(length):
+    return (8 - length % 8) % 8
+
+def encode_binary(parser, compress=False):
+    """
+    Encode the parsed layers as columnar arrays in a compact binary container.
+    
+    Parts are ordered by layer. The JSON header describes every column
+    (name, dtype, offset into the body, element count) together with the part
+    name table, per-layer offsets into the columns and per-layer brick counts,
+    so the reader can build typed array views directly on the body.
+    """
+    layers = parser.get_layers_data()['layers']
+    part_names = []
+    part_index = {}
+    columns = {
+        'layer': array('I'),
+        'color': array('i'),
+        'part': array('I'),
+        'x': array('f'),
+        'y': array('f'),
+        'z': array('f'),
+        'matrix': array('f'),
+    }
+    layer_offsets = array('I', [0])
+    
+    for layer in layers:
+        for part in layer['parts']:
+            name = part.part_name
+            if name not in part_index:
+                part_index[name] = len(part_names)
+                part_names.append(name)
+            columns['layer'].append(layer['layer'])
+            columns['color'].append(part.color)
+            columns['part'].append(part_index[name])
+            columns['x'].append(part.x)
+            columns['y'].append(part.y)
+            columns['z'].append(part.z)
+            columns['matrix'].extend(part.matrix)
+        layer_offsets.append(len(columns['layer']))
+    columns['layerOffsets'] = layer_offsets
+    
+    dtypes = {'I': 'uint32', 'i': 'int32', 'f': 'float32'}
+    body = bytearray()
+    column_info = []
+    for name, values in columns.items():
+        if sys.byteorder != 'little':
+            values.byteswap()
+        column_info.append({
+            'name': name,
+            'dtype': dtypes[values.typecode],
+            'offset': len(body),
+            'length': len(values)
+        })
+        body += values.tobytes()
+        body += b'\0' * _pad8(len(body))
+    
+    header = json.dumps({
+        'maxLayer': parser.max_layer,
+        'partCount': len(columns['layer']),
+        'partNames': part_names,
+        'partDimensions': [parser.get_brick_dimensions(name) for name in part_names],
+        'brickCounts': [layer['brickCounts'] for layer in layers],
+        'bodyLength': len(body),
+        'columns': column_info
+    }).encode('utf-8')
+    header += b' ' * _pad8(_BINARY_PREFIX.size + len(header))
+    
+    flags = 0
+    if compress:
+        body = zlib.compress(bytes(body), 6)
+        flags |= FLAG_ZLIB
+    return _BINARY_PREFIX.pack(BINARY_MAGIC, BINARY_VERSION, flags, len(header)) + header + bytes(body)
+
+def serve(cache, input_stream=sys.stdin, output_stream=sys.stdout):
+    """
+    Answer JSON requests, one per line, from a long-lived process.
+    
+    Each request is {"file": <ldr path>} for all layers, or
+    {"file": <ldr path>, "layer": <n>} for layers up to n. Each response is
+    written as a single JSON line.
+    """
+    for raw in input_stream:
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            request = json.loads(raw)
+            file_path = request['file']
+            if not os.path.exists(file_path):
+                response = {'error': f"File not found: {file_path}"}
+            elif request.get('layer') is None:
+                response = cache.get_layers_data(file_path)
+            else:
+                response = cache.get_layers_up_to(file_path, int(request['layer']))
+            if response is None:
+                response = {'error': f"Failed to parse LDR file: {file_path}"}
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            response = {'error': str(e)}
+        output_stream.write(dumps_layers(response) + '\n')
+        output_stream.flush()
+
 def main():
     """Main function to run the parser from command line."""
-    if len(sys.argv) < 2:
-        print("Usage: python ldr_parser.py <ldr_file_path>", file=sys.stderr)
+    usage = "Usage: python ldr_parser.py <ldr_file_path> [--format json|binary] [--compress] | --serve"
+    args = sys.argv[1:]
+    if not args:
+        print(usage, file=sys.stderr)
+        sys.exit(1)
+    
+    if args[0] == '--serve':
+        max_bytes = int(os.environ.get('LDR_CACHE_MAX_BYTES', DEFAULT_CACHE_BYTES))
+        serve(LdrModelCache(max_bytes=max_bytes))
+        sys.exit(0)
+    
+    output_format = 'json'
+    compress = False
+    positional = []
+    i = 0
+    while i < len(args):
+        if args[i] == '--format' and i + 1 < len(args):
+            output_format = args[i + 1]
+            i += 1
+        elif args[i].startswith('--format='):
+            output_format = args[i].split('=', 1)[1]
+        elif args[i] == '--compress':
+            compress = True
+        else:
+            positional.append(args[i])
+        i += 1
+    
+    if len(positional) != 1 or output_format not in ('json', 'binary'):
+        print(usage, file=sys.stderr)
         sys.exit(1)
     
-    ldr_file_path = sys.argv[1]
+    ldr_file_path = positional[0]
     
     if not os.path.exists(ldr_file_path):
         print(f"File not found: {ldr_file_path}", file=sys.stderr)
@@ -175,9 +569,14 @@ def main():
     
     parser = LdrParser(ldr_file_path)
     if parser.parse():
-        # Output JSON to stdout for the Node.js server to read
-        json_output = json.dumps(parser.get_layers_data())
-        print(json_output)
+        if output_format == 'binary':
+            # Columnar container for the Node.js server (see encode_binary)
+            sys.stdout.buffer.write(encode_binary(parser, compress=compress))
+            sys.stdout.buffer.flush()
+        else:
+            # Output JSON to stdout for the Node.js server to read
+            json_output = dumps_layers(parser.get_layers_data())
+            print(json_output)
         sys.exit(0)
     else:
         sys.exit(1)
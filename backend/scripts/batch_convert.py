@@ -0,0 +1,153 @@
+# Batch conversion of many meshes with obj_to_ldr.py on one process pool
+#
+# Every worker imports obj_to_ldr once and keeps its palette tables and
+# memoized color lookups for all the files it converts, instead of paying
+# interpreter start-up and imports per file. Writes one .ldr per input and a
+# summary.json with timings, brick counts and failures.
+#
+#   python batch_convert.py <directory | manifest.txt> <output_dir> [resolution]
+#                           [--jobs N] [obj_to_ldr.py options...]
+#
+# A manifest lists one input per line, optionally followed by a resolution;
+# blank lines and lines starting with # are skipped, and relative paths are
+# relative to the manifest.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import obj_to_ldr
+from job_control import JobCancelled
+
+MESH_EXTENSIONS = ('.obj', '.stl', '.ply', '.off', '.glb', '.gltf') + obj_to_ldr.VOXEL_GRID_EXTENSIONS
+
+
+def collect_inputs(source, default_resolution):
+    """(input path, resolution) pairs from a directory or a manifest file."""
+    if os.path.isdir(source):
+        return [(os.path.join(source, name), default_resolution)
+                for name in sorted(os.listdir(source)) if name.lower().endswith(MESH_EXTENSIONS)]
+
+    inputs = []
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            resolution = int(fields[1]) if len(fields) > 1 else default_resolution
+            inputs.append((os.path.join(base, fields[0]), resolution))
+    return inputs
+
+
+def output_names(input_paths):
+    """
+    One distinct .ldr name per input: its stem, or, for stems shared by
+    several inputs (banana.obj and banana.npz, or two folders' banana.obj),
+    its path relative to their common folder with the extension kept. Inputs
+    listed more than once get a numeric suffix.
+    """
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in input_paths]
+    shared = Counter(stems)
+    base = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in input_paths]) if input_paths else ''
+    names = []
+    for path, stem in zip(input_paths, stems):
+        if shared[stem] > 1:
+            stem = os.path.relpath(os.path.abspath(path), base).replace(os.sep, '_').replace('.', '_')
+        names.append(stem)
+
+    seen = Counter()
+    unique = []
+    for name in names:
+        seen[name] += 1
+        unique.append(f"{name}-{seen[name]}.ldr" if names.count(name) > 1 else name + '.ldr')
+    return unique
+
+
+def _convert_one(input_path, output_path, resolution, extra_args):
+    # Runs in a pool worker; the converter's log is kept only for failures
+    args = obj_to_ldr.build_arg_parser().parse_args(
+        [input_path, output_path, str(resolution), '--workers', '1', *extra_args])
+    log = io.StringIO()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(log):
+            summary = obj_to_ldr.convert_model(args)
+        if 'estimates' in summary:
+            # --estimate: nothing was converted
+            summary['status'] = 'estimated'
+        else:
+            summary['status'] = 'partial' if summary.get('degraded') else 'ok'
+    except JobCancelled as e:
+        summary = {'input': input_path, 'output': output_path, 'status': 'timeout', 'error': str(e)}
+    except Exception as e:
+        summary = {'input': input_path, 'output': output_path, 'status': 'failed', 'error': str(e),
+                   'log': log.getvalue()[-2000:]}
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+def convert_batch(inputs, output_dir, jobs=None, extra_args=()):
+    """
+    Convert (input path, resolution) pairs into output_dir on a pool of
+    `jobs` processes (default: all cores). Returns the per-file summaries in
+    input order.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    results = [None] * len(inputs)
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        futures = {}
+        names = output_names([input_path for input_path, _ in inputs])
+        for i, ((input_path, resolution), name) in enumerate(zip(inputs, names)):
+            output_path = os.path.join(output_dir, name)
+            futures[pool.submit(_convert_one, input_path, output_path, resolution, list(extra_args))] = i
+        for future in as_completed(futures):
+            summary = future.result()
+            results[futures[future]] = summary
+            if 'bricks' in summary:
+                detail = f"{summary['bricks']} bricks"
+            elif 'estimates' in summary:
+                detail = f"{len(summary['estimates'])} resolutions estimated"
+            else:
+                detail = summary.get('error', '')
+            print(f"[{summary['status']}] {summary['input']} ({summary['seconds']:.1f}s) {detail}")
+    return results
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Convert a directory or manifest of meshes to LDraw models")
+    arg_parser.add_argument('source', help="directory of meshes or manifest file")
+    arg_parser.add_argument('output_dir')
+    arg_parser.add_argument('resolution', nargs='?', type=int, default=64)
+    arg_parser.add_argument('--jobs', type=int, default=None, help="worker processes (default: all cores)")
+    arg_parser.add_argument('--summary', default=None, help="summary file (default: <output_dir>/summary.json)")
+    args, extra_args = arg_parser.parse_known_args()
+    # Check the forwarded options once here; in the workers a bad one would exit every job
+    converter_parser = obj_to_ldr.build_arg_parser()
+    converter_parser.error = lambda message: arg_parser.error(f"obj_to_ldr.py option: {message}")
+    converter_parser.parse_args(['input', 'output', *extra_args])
+
+    inputs = collect_inputs(args.source, args.resolution)
+    if not inputs:
+        print(f"Error: no meshes found in {args.source}")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    results = convert_batch(inputs, args.output_dir, jobs=args.jobs, extra_args=extra_args)
+    elapsed = time.perf_counter() - start
+
+    summary_path = args.summary or os.path.join(args.output_dir, 'summary.json')
+    with open(summary_path, 'w') as f:
+        json.dump({'seconds': elapsed, 'files': results}, f, indent=2)
+
+    failed = [r for r in results if r['status'] in ('failed', 'timeout')]
+    print(f"Converted {len(results) - len(failed)}/{len(results)} files in {elapsed:.1f}s; "
+          f"summary written to {summary_path}")
+    if failed:
+        sys.exit(1)
@@ -18,55 +18,59 @@
 """
 Binvox to Numpy and back.
 
+The examples below need a chair.binvox in the working directory, so
+doctest skips them; the function docstrings carry self-contained ones.
 
->>> import numpy as np
->>> import binvox_rw
->>> with open('chair.binvox', 'rb') as f:
+>>> import numpy as np  # doctest: +SKIP
+>>> import binvox_rw  # doctest: +SKIP
+>>> with open('chair.binvox', 'rb') as f:  # doctest: +SKIP
 ...     m1 = binvox_rw.read_as_3d_array(f)
 ...
->>> m1.dims
+>>> m1.dims  # doctest: +SKIP
 [32, 32, 32]
->>> m1.scale
+>>> m1.scale  # doctest: +SKIP
 41.133000000000003
->>> m1.translate
+>>> m1.translate  # doctest: +SKIP
 [0.0, 0.0, 0.0]
->>> with open('chair_out.binvox', 'wb') as f:
+>>> with open('chair_out.binvox', 'wb') as f:  # doctest: +SKIP
 ...     m1.write(f)
 ...
->>> with open('chair_out.binvox', 'rb') as f:
+>>> with open('chair_out.binvox', 'rb') as f:  # doctest: +SKIP
 ...     m2 = binvox_rw.read_as_3d_array(f)
 ...
->>> m1.dims==m2.dims
+>>> m1.dims==m2.dims  # doctest: +SKIP
 True
->>> m1.scale==m2.scale
+>>> m1.scale==m2.scale  # doctest: +SKIP
 True
->>> m1.translate==m2.translate
+>>> m1.translate==m2.translate  # doctest: +SKIP
 True
->>> np.all(m1.data==m2.data)
+>>> np.all(m1.data==m2.data)  # doctest: +SKIP
 True
 
->>> with open('chair.binvox', 'rb') as f:
+>>> with open('chair.binvox', 'rb') as f:  # doctest: +SKIP
 ...     md = binvox_rw.read_as_3d_array(f)
 ...
->>> with open('chair.binvox', 'rb') as f:
+>>> with open('chair.binvox', 'rb') as f:  # doctest: +SKIP
 ...     ms = binvox_rw.read_as_coord_array(f)
 ...
->>> data_ds = binvox_rw.dense_to_sparse(md.data)
->>> data_sd = binvox_rw.sparse_to_dense(ms.data, 32)
->>> np.all(data_sd==md.data)
+>>> data_ds = binvox_rw.dense_to_sparse(md.data)  # doctest: +SKIP
+>>> data_sd = binvox_rw.sparse_to_dense(ms.data, 32)  # doctest: +SKIP
+>>> np.all(data_sd==md.data)  # doctest: +SKIP
 True
 >>> # the ordering of elements returned by numpy.nonzero changes with axis
 >>> # ordering, so to compare for equality we first lexically sort the voxels.
->>> np.all(ms.data[:, np.lexsort(ms.data)] == data_ds[:, np.lexsort(data_ds)])
+>>> np.all(ms.data[:, np.lexsort(ms.data)] == data_ds[:, np.lexsort(data_ds)])  # doctest: +SKIP
 True
 """
 
+import mmap
 import numpy as np
 
 class Voxels(object):
     """ Holds a binvox model.
-    data is either a three-dimensional numpy boolean array (dense representation)
-    or a two-dimensional numpy float array (coordinate representation).
+    data is either a three-dimensional numpy boolean array (dense representation),
+    a two-dimensional numpy int array (coordinate representation) or a
+    PackedGrid (bit-packed representation, 8 voxels per byte).
 
     dims, translate and scale are the model metadata.
 
@@ -94,6 +98,8 @@ class Voxels(object):
         self.axis_order = axis_order
 
     def clone(self):
+        # PackedGrid.copy() shares its slice planes, so cloning a packed
+        # model doesn't copy any voxel data until a slice is replaced
         data = self.data.copy()
         dims = self.dims[:]
         translate = self.translate[:]
@@ -150,11 +156,28 @@ def read_as_3d_array(fp, fix_coords=True):
         axis_order = 'xzy'
     return Voxels(data, dims, translate, scale, axis_order)
 
+def filled_run_indices(values, counts):
+    """ Linear indices of the filled voxels of a run-length encoded stream.
+
+    The filled runs are expanded with a single repeat/arange, without a
+    Python loop over runs.
+
+    >>> filled_run_indices(np.array([0, 1, 0, 1]), np.array([2, 3, 1, 2]))
+    array([2, 3, 4, 6, 7])
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    starts = np.cumsum(counts) - counts
+    filled = np.asarray(values) != 0
+    starts, lengths = starts[filled], counts[filled]
+    # position of each output voxel inside its run, shifted to the run start
+    run_offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - run_offsets, lengths) + np.arange(lengths.sum())
+
 def read_as_coord_array(fp, fix_coords=True):
     """ Read binary binvox format as coordinates.
 
     Returns binvox model with voxels in a "coordinate" representation, i.e.  an
-    3 x N array where N is the number of nonzero voxels. Each column
+    3 x N integer array where N is the number of nonzero voxels. Each column
     corresponds to a nonzero voxel and the 3 rows are the (x, z, y) coordinates
     of the voxel.  (The odd ordering is due to the way binvox format lays out
     data).  Note that coordinates refer to the binvox voxels, without any
@@ -163,33 +186,30 @@ def read_as_coord_array(fp, fix_coords=True):
     Use this to save memory if your model is very sparse (mostly empty).
 
     Doesn't do any checks on input except for the '#binvox' line.
+
+    >>> import io
+    >>> data = np.zeros((8, 8, 8), dtype=bool)
+    >>> data[1:7, 2, 3:5] = True
+    >>> fp = io.BytesIO()
+    >>> write(Voxels(data, [8, 8, 8], [0.0, 0.0, 0.0], 1.0, 'xyz'), fp)
+    >>> _ = fp.seek(0)
+    >>> ms = read_as_coord_array(fp)
+    >>> ms.data.dtype.kind
+    'i'
+    >>> np.array_equal(sparse_to_dense(ms.data, 8), data)
+    True
     """
     dims, translate, scale = read_header(fp)
     raw_data = np.frombuffer(fp.read(), dtype=np.uint8)
 
     values, counts = raw_data[::2], raw_data[1::2]
+    nz_voxels = filled_run_indices(values, counts)
 
-    sz = np.prod(dims)
-    index, end_index = 0, 0
-    end_indices = np.cumsum(counts)
-    indices = np.concatenate(([0], end_indices[:-1])).astype(end_indices.dtype)
-
-    values = values.astype(np.bool)
-    indices = indices[values]
-    end_indices = end_indices[values]
-
-    nz_voxels = []
-    for index, end_index in zip(indices, end_indices):
-        nz_voxels.extend(range(index, end_index))
-    nz_voxels = np.array(nz_voxels)
-    # TODO are these dims correct?
     # according to docs,
     # index = x * wxh + z * width + y; // wxh = width * height = d * d
-
-    x = nz_voxels / (dims[0]*dims[1])
-    zwpy = nz_voxels % (dims[0]*dims[1]) # z*w + y
-    z = zwpy / dims[0]
-    y = zwpy % dims[0]
+    # which matches the reshape(dims) done by read_as_3d_array
+    x, zwpy = np.divmod(nz_voxels, dims[1]*dims[2]) # zwpy = z*w + y
+    z, y = np.divmod(zwpy, dims[2])
     if fix_coords:
         data = np.vstack((x, y, z))
         axis_order = 'xyz'
@@ -197,9 +217,170 @@ def read_as_coord_array(fp, fix_coords=True):
         data = np.vstack((x, z, y))
         axis_order = 'xzy'
 
-    #return Voxels(data, dims, translate, scale, axis_order)
     return Voxels(np.ascontiguousarray(data), dims, translate, scale, axis_order)
 
+class PackedGrid(object):
+    """ Bit-packed boolean grid, 8 voxels per byte.
+
+    The grid is kept as one packed plane per slice along the last axis (for
+    an 'xyz' model, one plane per z layer), each of shape
+    (shape[0], ceil(shape[1] / 8)). Planes are read-only and shared between
+    copies: copy() only copies the list of planes and set_slice() replaces a
+    single plane, so many grids derived from one another stay cheap to keep
+    resident.
+
+    >>> data = np.zeros((5, 11, 4), dtype=bool)
+    >>> data[1:4, 2:9, 1:3] = True
+    >>> packed = dense_to_packed(data)
+    >>> packed.nbytes
+    40
+    >>> np.array_equal(packed_to_dense(packed), data)
+    True
+    >>> np.array_equal(packed.unpack_slice(2), data[:, :, 2])
+    True
+    >>> other = packed.copy()
+    >>> other.set_slice(0, np.ones((5, 11), dtype=bool))
+    >>> other.planes[1] is packed.planes[1], int(packed.unpack_slice(0).sum())
+    (True, 0)
+    """
+
+    def __init__(self, planes, shape):
+        self.planes = planes
+        self.shape = tuple(shape)
+
+    @property
+    def nbytes(self):
+        return sum(plane.nbytes for plane in self.planes)
+
+    def unpack_slice(self, index):
+        """ Dense bool array for one slice along the last axis. """
+        return np.unpackbits(self.planes[index], axis=1, count=self.shape[1]).view(bool)
+
+    def set_slice(self, index, mask):
+        """ Replace one slice; other copies keep the previous plane. """
+        mask = np.asarray(mask, dtype=bool)
+        if mask.shape != self.shape[:2]:
+            raise ValueError('mask is wrong shape; should be %s.' % (self.shape[:2],))
+        plane = np.packbits(mask, axis=1)
+        plane.flags.writeable = False
+        self.planes[index] = plane
+
+    def copy(self):
+        return PackedGrid(list(self.planes), self.shape)
+
+def dense_to_packed(voxel_data):
+    """ From dense representation to bit-packed representation.
+    No coordinate reordering.
+    """
+    if voxel_data.ndim!=3:
+        raise ValueError('voxel_data is wrong shape; should be 3D array.')
+    # (i, ceil(j/8), k) -> one contiguous plane per k
+    packed = np.ascontiguousarray(np.moveaxis(np.packbits(voxel_data, axis=1), 2, 0))
+    packed.flags.writeable = False
+    return PackedGrid(list(packed), voxel_data.shape)
+
+def packed_to_dense(packed):
+    """ From bit-packed representation to a dense boolean array. """
+    if not packed.planes:
+        return np.zeros(packed.shape, dtype=bool)
+    planes = np.stack(packed.planes)
+    dense = np.unpackbits(planes, axis=2, count=packed.shape[1]).view(bool)
+    return np.ascontiguousarray(np.moveaxis(dense, 0, 2))
+
+class SliceReader(object):
+    """ Memory-mapped binvox reader that decodes the model slab by slab.
+
+    Only the run-length table (one int64 end offset per run) is built up
+    front. Each call to read_slab() decodes just the voxels of the requested
+    z range straight from the mapped file, so a large model can be consumed
+    layer by layer without ever building the full grid.
+
+    Slabs follow the reader's axis order: with fix_coords (the default) a
+    slab for z in [z0, z1) has shape (dims[0], dims[2], z1-z0) and matches
+    read_as_3d_array(fp).data[:, :, z0:z1]; otherwise it has shape
+    (dims[0], z1-z0, dims[2]) in the raw xzy order.
+
+    >>> import os, tempfile
+    >>> data = np.zeros((8, 8, 8), dtype=bool)
+    >>> data[2:6, 1:7, 3:] = True
+    >>> path = os.path.join(tempfile.mkdtemp(), 'model.binvox')
+    >>> with open(path, 'wb') as f:
+    ...     write(Voxels(data, [8, 8, 8], [0.0, 0.0, 0.0], 1.0, 'xyz'), f)
+    >>> with SliceReader(path) as reader:
+    ...     slabs = [slab for z, slab in reader.iter_slabs(3)]
+    >>> [slab.shape[2] for slab in slabs]
+    [3, 3, 2]
+    >>> np.array_equal(np.concatenate(slabs, axis=2), data)
+    True
+    """
+
+    def __init__(self, path, fix_coords=True):
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.dims, self.translate, self.scale = read_header(self._map)
+            raw_data = np.frombuffer(self._map, dtype=np.uint8, offset=self._map.tell())
+        except Exception:
+            self._file.close()
+            raise
+        self._values = raw_data[::2]
+        self._run_ends = np.cumsum(raw_data[1::2], dtype=np.int64)
+        self.axis_order = 'xyz' if fix_coords else 'xzy'
+
+    @property
+    def depth(self):
+        """ Number of z slices (the middle axis of the raw binvox layout). """
+        return self.dims[1]
+
+    def read_slab(self, z0, z1=None):
+        """ Decode slices z0..z1-1 (just z0 if z1 is None) as a bool array. """
+        if z1 is None:
+            z1 = z0 + 1
+        z0, z1 = max(0, z0), min(self.depth, z1)
+        d0, d1, d2 = self.dims
+        # index = x * wxh + z * width + y; each x row contributes one
+        # contiguous chunk of (z1-z0)*width voxels
+        row_starts = np.arange(d0, dtype=np.int64) * (d1 * d2)
+        indices = row_starts[:, None] + np.arange(z0 * d2, z1 * d2, dtype=np.int64)
+        runs = np.searchsorted(self._run_ends, indices, side='right')
+        slab = (self._values[runs] != 0).reshape(d0, z1 - z0, d2)
+        if self.axis_order == 'xyz':
+            slab = np.ascontiguousarray(np.transpose(slab, (0, 2, 1)))
+        return slab
+
+    def iter_slabs(self, slab_size=1):
+        """ Yield (z0, slab) for consecutive slabs of slab_size z slices. """
+        for z0 in range(0, self.depth, slab_size):
+            yield z0, self.read_slab(z0, z0 + slab_size)
+
+    def read_packed(self, slab_size=16):
+        """ Read the whole model as a PackedGrid, one slab at a time.
+
+        Requires fix_coords so the packed slices are z layers.
+        """
+        if self.axis_order != 'xyz':
+            raise ValueError('read_packed needs an xyz ordered reader')
+        planes = []
+        for z0, slab in self.iter_slabs(slab_size):
+            planes.extend(dense_to_packed(slab).planes)
+        shape = (self.dims[0], self.dims[2], self.depth)
+        return Voxels(PackedGrid(planes, shape), self.dims[:], self.translate[:],
+                      self.scale, self.axis_order)
+
+    def close(self):
+        # numpy views must be released before the mapping can be closed
+        self._values = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
 def dense_to_sparse(voxel_data, dtype=int):
     """ From dense representation to sparse (coordinate) representation.
     No coordinate reordering.
@@ -215,7 +396,7 @@ def sparse_to_dense(voxel_data, dims, dtype=bool):
         dims = [dims]*3
     dims = np.atleast_2d(dims).T
     # truncate to integers
-    xyz = voxel_data.astype(np.int)
+    xyz = voxel_data.astype(int)
     # discard voxels that fall outside dims
     valid_ix = ~np.any((xyz < 0) | (xyz >= dims), 0)
     xyz = xyz[:,valid_ix]
@@ -229,55 +410,79 @@ def sparse_to_dense(voxel_data, dims, dtype=bool):
     #"""
     #return x*(dims[1]*dims[2]) + z*dims[1] + y
 
+def rle_encode(voxels_flat):
+    """ Run-length encode a flat voxel array as binvox (value, count) byte pairs.
+
+    Run boundaries are found with array operations and runs longer than 255
+    are split in bulk, so the whole payload is built without a Python loop.
+
+    >>> rle_encode(np.array([0, 0, 1, 1, 1, 0], dtype=bool))
+    b'\\x00\\x02\\x01\\x03\\x00\\x01'
+    >>> len(rle_encode(np.ones(600, dtype=bool)))
+    6
+    """
+    values = (np.asarray(voxels_flat).ravel() != 0).view(np.uint8)
+    if values.size == 0:
+        return b''
+    starts = np.flatnonzero(values[1:] != values[:-1]) + 1
+    starts = np.concatenate(([0], starts))
+    lengths = np.diff(np.append(starts, values.size))
+
+    # each run becomes ceil(length / 255) pairs; all but the last are full
+    n_pairs = (lengths + 254) // 255
+    last_pair = np.cumsum(n_pairs) - 1
+    counts = np.full(last_pair[-1] + 1, 255, dtype=np.uint8)
+    counts[last_pair] = lengths - 255 * (n_pairs - 1)
+
+    pairs = np.empty((counts.size, 2), dtype=np.uint8)
+    pairs[:, 0] = np.repeat(values[starts], n_pairs)
+    pairs[:, 1] = counts
+    return pairs.tobytes()
+
 def write(voxel_model, fp):
     """ Write binary binvox format.
 
     Note that when saving a model in sparse (coordinate) format, it is first
     converted to dense format.
 
-    Doesn't check if the model is 'sane'.
-
+    Doesn't check if the model is 'sane'. fp must be opened in binary mode.
+
+    >>> import io
+    >>> data = np.zeros((16, 16, 16), dtype=bool)
+    >>> data[2:14, 1:9, 3:] = True
+    >>> fp = io.BytesIO()
+    >>> write(Voxels(data, [16, 16, 16], [0.0, 0.0, 0.0], 1.0, 'xyz'), fp)
+    >>> _ = fp.seek(0)
+    >>> m = read_as_3d_array(fp)
+    >>> m.dims, m.translate, m.scale
+    ([16, 16, 16], [0.0, 0.0, 0.0], 1.0)
+    >>> np.array_equal(m.data, data)
+    True
     """
-    if voxel_model.data.ndim==2:
+    if isinstance(voxel_model.data, PackedGrid):
+        dense_voxel_data = packed_to_dense(voxel_model.data)
+    elif voxel_model.data.ndim==2:
         # TODO avoid conversion to dense
         dense_voxel_data = sparse_to_dense(voxel_model.data, voxel_model.dims)
     else:
         dense_voxel_data = voxel_model.data
 
-    fp.write('#binvox 1\n')
-    fp.write('dim '+' '.join(map(str, voxel_model.dims))+'\n')
-    fp.write('translate '+' '.join(map(str, voxel_model.translate))+'\n')
-    fp.write('scale '+str(voxel_model.scale)+'\n')
-    fp.write('data\n')
     if not voxel_model.axis_order in ('xzy', 'xyz'):
         raise ValueError('Unsupported voxel model axis order')
 
+    header = ('#binvox 1\n'
+              'dim '+' '.join(map(str, voxel_model.dims))+'\n'
+              'translate '+' '.join(map(str, voxel_model.translate))+'\n'
+              'scale '+str(voxel_model.scale)+'\n'
+              'data\n')
+    fp.write(header.encode('ascii'))
+
     if voxel_model.axis_order=='xzy':
-        voxels_flat = dense_voxel_data.flatten()
+        voxels_flat = dense_voxel_data.ravel()
     elif voxel_model.axis_order=='xyz':
-        voxels_flat = np.transpose(dense_voxel_data, (0, 2, 1)).flatten()
-
-    # keep a sort of state machine for writing run length encoding
-    state = voxels_flat[0]
-    ctr = 0
-    for c in voxels_flat:
-        if c==state:
-            ctr += 1
-            # if ctr hits max, dump
-            if ctr==255:
-                fp.write(chr(state))
-                fp.write(chr(ctr))
-                ctr = 0
-        else:
-            # if switch state, dump
-            fp.write(chr(state))
-            fp.write(chr(ctr))
-            state = c
-            ctr = 1
-    # flush out remainders
-    if ctr > 0:
-        fp.write(chr(state))
-        fp.write(chr(ctr))
+        voxels_flat = np.transpose(dense_voxel_data, (0, 2, 1)).ravel()
+
+    fp.write(rle_encode(voxels_flat))
 
 if __name__ == '__main__':
     import doctest
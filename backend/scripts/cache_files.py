@@ -0,0 +1,58 @@
+# File helpers shared by the on-disk caches
+#
+# Cache entries are written to a temporary file in the cache directory and
+# renamed into place, so a concurrent reader never sees a partial entry, and
+# every cache directory is kept under a byte budget by deleting its least
+# recently used entries. Used by the voxel, mesh and plan caches here and by
+# the generation cache at the repository root.
+
+import os
+import tempfile
+from contextlib import contextmanager
+
+TEMP_SUFFIX = '.tmp'
+
+
+@contextmanager
+def atomic_write(path, mode='wb'):
+    """
+    Open a temporary file next to `path` for writing. It replaces `path`
+    when the block finishes and is removed if the block raises.
+    """
+    fd, temp_path = tempfile.mkstemp(suffix=TEMP_SUFFIX, dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def evict_lru(cache_dir, max_bytes, suffix=''):
+    """
+    Delete the least recently used `suffix` files in cache_dir until their
+    total size fits max_bytes. Files still being written are left alone.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(suffix) or name.endswith(TEMP_SUFFIX):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    # The newest entry is always kept, even when it alone exceeds the budget
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries)[:-1]:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
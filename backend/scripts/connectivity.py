@@ -0,0 +1,108 @@
+# Structural connectivity of a brick plan
+#
+# Bricks only hold together through stud overlap with the layer directly
+# above or below; touching side by side in one layer doesn't connect them.
+# The analysis finds every overlapping pair between adjacent layers with a
+# grid hash over the bricks' footprint cells, then merges the pairs with a
+# vectorized union-find, so 100k-brick plans take a fraction of a second.
+
+import numpy as np
+
+
+def brick_footprints(brick_layers):
+    """
+    Arrays (z, y0, x0, rows, cols) of every brick in a plan from
+    place_bricks_in_layers, in plan order. y0/x0 are grid coordinates of the
+    brick's first cell; rows/cols its extent along the first/second grid axis.
+    """
+    footprints = [(layer['z'], layer['offset'][0].start + brick[0], layer['offset'][1].start + brick[1],
+                   brick[3], brick[2])
+                  for layer in brick_layers for brick in layer['bricks']]
+    if not footprints:
+        return tuple(np.zeros(0, dtype=np.int64) for _ in range(5))
+    return tuple(np.array(footprints, dtype=np.int64).T)
+
+
+def overlap_pairs(z, y0, x0, rows, cols):
+    """
+    Unique (lower, upper) brick index pairs whose footprints share a cell
+    and whose layers are adjacent.
+    """
+    n = len(z)
+    if n == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+
+    # Every footprint cell, tagged with its brick
+    area = rows * cols
+    brick = np.repeat(np.arange(n), area)
+    k = np.arange(len(brick)) - np.repeat(np.cumsum(area) - area, area)
+    y = y0[brick] + k // cols[brick]
+    x = x0[brick] + k % cols[brick]
+
+    # Grid hash: one integer per (z, y, x) cell; a cell's neighbor above is key + layer_size
+    width = int(x.max()) + 1
+    layer_size = (int(y.max()) + 1) * width
+    key = (z[brick] - z.min()) * layer_size + y * width + x
+    order = np.argsort(key, kind='stable')
+    sorted_key, sorted_brick = key[order], brick[order]
+
+    above = key + layer_size
+    pos = np.minimum(np.searchsorted(sorted_key, above), len(sorted_key) - 1)
+    hit = sorted_key[pos] == above
+    pairs = np.unique(brick[hit] * n + sorted_brick[pos[hit]])
+    return pairs // n, pairs % n
+
+
+def union_find(n, a, b):
+    """
+    Root of every node after merging the pairs (a[i], b[i]). Roots are the
+    smallest node of each group. Hooks roots onto smaller roots and
+    compresses all paths each round, so every round is a few array
+    operations and the forest stays acyclic.
+    """
+    parent = np.arange(n)
+    while True:
+        ra, rb = parent[a], parent[b]
+        differ = ra != rb
+        if not differ.any():
+            return parent
+        lo = np.minimum(ra[differ], rb[differ])
+        hi = np.maximum(ra[differ], rb[differ])
+        np.minimum.at(parent, hi, lo)
+        # Pointer jumping until every node points at its root
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+
+def analyze_connectivity(brick_layers):
+    """
+    Group the bricks of a plan into structurally connected groups.
+
+    Returns a dict with:
+        bricks: number of bricks
+        groups: number of connected groups
+        group_sizes: bricks per group, largest first
+        group_of: group index of every brick, in plan order (0 = largest)
+        disconnected_bricks: bricks outside the largest group
+    """
+    z, y0, x0, rows, cols = brick_footprints(brick_layers)
+    n = len(z)
+    lower, upper = overlap_pairs(z, y0, x0, rows, cols)
+    roots = union_find(n, lower, upper)
+
+    # Number the groups by size, largest first
+    unique_roots, group, sizes = np.unique(roots, return_inverse=True, return_counts=True)
+    by_size = np.argsort(-sizes, kind='stable')
+    rank = np.empty_like(by_size)
+    rank[by_size] = np.arange(len(by_size))
+    return {
+        'bricks': n,
+        'groups': len(unique_roots),
+        'group_sizes': sizes[by_size],
+        'group_of': rank[group.ravel()] if n else group,
+        'disconnected_bricks': int(n - sizes.max()) if n else 0,
+    }
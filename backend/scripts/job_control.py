@@ -0,0 +1,151 @@
+# Progress reporting, deadlines and cancellation for obj_to_ldr.py jobs
+#
+# Progress goes out as JSON lines on a dedicated file descriptor, separate
+# from the human-readable log on stdout, so a parent process (ModelToLDR.js)
+# can follow a long conversion without parsing free-form text. Every event
+# carries the overall progress in [0, 1], estimated from fixed stage weights.
+#
+# A CancelToken carries the job's deadline and cancellation request. Long
+# stages poll it between components or layers and wind down early, so a
+# stuck job frees its worker instead of having to be killed.
+
+import json
+import os
+import signal
+import time
+from contextlib import contextmanager
+
+# Exit code of obj_to_ldr.py when a job is stopped by its deadline or cancelled
+TIMEOUT_EXIT_CODE = 3
+
+# (stage, share of the total work) in pipeline order
+CONVERSION_STAGES = (
+    ('load', 0.05),
+    ('voxelize', 0.25),
+    ('prepare', 0.15),
+    ('place', 0.40),
+    ('color', 0.10),
+    ('save', 0.05),
+)
+
+
+class ProgressReporter:
+    """
+    Writes progress events as JSON lines to `stream`, or does nothing when
+    stream is None. Events outside a stage (partial, error) carry the
+    progress reached so far. Events:
+
+        {"event": "stage_start", "stage": ..., "progress": ..., "elapsed": ...}
+        {"event": "stage_end", "stage": ..., "seconds": ..., ...}
+        {"event": "layers", "stage": "place", "done": ..., "total": ..., "bricks": ..., ...}
+        {"event": "partial", "stage": null, "degraded": [...], ...}
+        {"event": "error", "stage": null, "message": ..., ...}
+    """
+
+    def __init__(self, stream=None, stages=CONVERSION_STAGES):
+        self.stream = stream
+        self.start = time.perf_counter()
+        # Seconds per finished stage, recorded even without a stream
+        self.timings = {}
+        # Progress of the latest event
+        self._last = 0.0
+        # Cumulative progress at the start of each stage
+        self._offsets = {}
+        self._weights = dict(stages)
+        offset = 0.0
+        for name, weight in stages:
+            self._offsets[name] = offset
+            offset += weight
+
+    @classmethod
+    def from_fd(cls, fd):
+        """Reporter writing to an inherited file descriptor (None: disabled)."""
+        if fd is None:
+            return cls()
+        return cls(os.fdopen(fd, 'w', buffering=1))
+
+    def _progress(self, stage, fraction=0.0):
+        return min(1.0, self._offsets.get(stage, 0.0) + self._weights.get(stage, 0.0) * fraction)
+
+    def emit(self, event, stage, fraction=0.0, **fields):
+        if self.stream is None:
+            return
+        if stage is not None:
+            self._last = self._progress(stage, fraction)
+        record = {'event': event, 'stage': stage, 'progress': round(self._last, 4),
+                  'elapsed': round(time.perf_counter() - self.start, 3)}
+        record.update(fields)
+        try:
+            self.stream.write(json.dumps(record) + '\n')
+        except (OSError, ValueError):
+            # The reader went away; progress is best effort
+            self.stream = None
+
+    @contextmanager
+    def stage(self, name):
+        """Emit stage_start/stage_end around a block."""
+        started = time.perf_counter()
+        self.emit('stage_start', name)
+        yield
+        seconds = time.perf_counter() - started
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+        self.emit('stage_end', name, 1.0, seconds=round(seconds, 3))
+
+    def layers(self, done, total, bricks):
+        """Placement progress: `done` of `total` layers placed, `bricks` so far."""
+        self.emit('layers', 'place', done / total if total else 1.0, done=done, total=total, bricks=bricks)
+
+
+class JobCancelled(Exception):
+    """The job was cancelled before it finished."""
+
+
+class JobTimeout(JobCancelled):
+    """The job ran past its deadline without a usable partial result."""
+
+
+class CancelToken:
+    """
+    Deadline and cancellation flag shared by the stages of one job.
+
+    Stages call stop_requested() at component or layer granularity and, when
+    it returns True, stop early with whatever they have, recording
+    themselves through degrade(). check() raises instead, for stages without
+    a usable partial result.
+    """
+
+    def __init__(self, deadline=None):
+        # deadline: seconds from now, or None for no limit
+        self.expires = time.monotonic() + deadline if deadline is not None else None
+        self.cancelled = False
+        self.degraded = []
+
+    def cancel(self):
+        self.cancelled = True
+
+    def cancel_on_signal(self, signum=signal.SIGTERM):
+        """Turn `signum` into a cooperative cancellation instead of process death."""
+        signal.signal(signum, lambda *_: self.cancel())
+
+    @property
+    def timed_out(self):
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    def stop_requested(self):
+        return self.cancelled or self.timed_out
+
+    def remaining(self):
+        """Seconds left before the deadline (None without one)."""
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    def degrade(self, stage):
+        if stage not in self.degraded:
+            self.degraded.append(stage)
+
+    def check(self):
+        if self.cancelled:
+            raise JobCancelled("job cancelled")
+        if self.timed_out:
+            raise JobTimeout("job deadline exceeded")
@@ -0,0 +1,96 @@
+# Binary mesh cache for fast repeated mesh loading
+#
+# Parsing a text OBJ dominates trimesh.load. The first load of a file writes
+# its processed vertices, faces and vertex colors to a compact binary file
+# keyed by the file's content hash; later loads memory-map that file and
+# build the Trimesh without parsing or re-processing anything.
+
+import os
+import struct
+import tempfile
+import numpy as np
+import trimesh
+from cache_files import atomic_write, evict_lru
+from voxel_cache import file_sha256
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'LDR_MESH_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'model_to_ldr_mesh_cache'))
+DEFAULT_MAX_BYTES = int(os.environ.get('LDR_MESH_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# Layout: magic | uint64 vertex count | uint64 face count, followed by
+# float64 vertices (n x 3), int32 faces (m x 3) and uint8 RGBA colors (n x 4),
+# each starting on an 8-byte boundary
+MESH_MAGIC = b'LDRMESH1'
+_HEADER = struct.Struct('<8sQQ')
+
+
+def _align8(offset):
+    return offset + (8 - offset % 8) % 8
+
+
+def _layout(n_vertices, n_faces):
+    vertices_at = _HEADER.size
+    faces_at = _align8(vertices_at + n_vertices * 3 * 8)
+    colors_at = _align8(faces_at + n_faces * 3 * 4)
+    return vertices_at, faces_at, colors_at
+
+
+class MeshCache:
+    """Content-addressed directory of binary mesh files, evicted LRU past max_bytes."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, content_hash):
+        return os.path.join(self.cache_dir, content_hash + '.mesh')
+
+    def load(self, path, content_hash=None):
+        """
+        Load a mesh like trimesh.load(path, force='mesh'), going through the
+        cache. content_hash can be passed when the caller already hashed the file.
+        """
+        if content_hash is None:
+            content_hash = file_sha256(path)
+        mesh = self._read(self._path(content_hash))
+        if mesh is None:
+            mesh = trimesh.load(path, force='mesh')
+            self._write(self._path(content_hash), mesh)
+        return mesh
+
+    def _read(self, cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                magic, n_vertices, n_faces = _HEADER.unpack(f.read(_HEADER.size))
+        except (OSError, struct.error):
+            return None
+        if magic != MESH_MAGIC:
+            return None
+        vertices_at, faces_at, colors_at = _layout(n_vertices, n_faces)
+        try:
+            vertices = np.memmap(cache_path, np.float64, 'r', vertices_at, (n_vertices, 3))
+            faces = np.memmap(cache_path, np.int32, 'r', faces_at, (n_faces, 3))
+            colors = np.memmap(cache_path, np.uint8, 'r', colors_at, (n_vertices, 4))
+        except (OSError, ValueError):
+            return None
+        try:
+            # Another process's eviction may have removed the file; the mapping stays valid
+            os.utime(cache_path)
+        except OSError:
+            pass
+        # The arrays are already processed; process=False keeps them as stored
+        return trimesh.Trimesh(vertices=vertices, faces=faces, vertex_colors=colors, process=False)
+
+    def _write(self, cache_path, mesh):
+        vertices = np.ascontiguousarray(mesh.vertices, dtype=np.float64)
+        faces = np.ascontiguousarray(mesh.faces, dtype=np.int32)
+        colors = np.ascontiguousarray(mesh.visual.vertex_colors, dtype=np.uint8)
+        vertices_at, faces_at, colors_at = _layout(len(vertices), len(faces))
+
+        with atomic_write(cache_path) as f:
+            f.write(_HEADER.pack(MESH_MAGIC, len(vertices), len(faces)))
+            for offset, array in ((vertices_at, vertices), (faces_at, faces), (colors_at, colors)):
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(array.tobytes())
+        evict_lru(self.cache_dir, self.max_bytes, '.mesh')
@@ -1,17 +1,193 @@
 # LEGO Model Generator (Final Version with Interior/Exterior Mask for Solid Fill and Color Mapping)
 
 import os
+import sys
+import time
+import argparse
+import tracemalloc
+from functools import lru_cache
 import numpy as np
 from pathlib import Path
 import trimesh
 from scipy.ndimage import label, binary_fill_holes
 from scipy.spatial import distance, KDTree
 import colorsys
+from concurrent.futures import ProcessPoolExecutor
+import binvox_rw
+from voxel_cache import VoxelCache, file_sha256, DEFAULT_CACHE_DIR
+from mesh_cache import MeshCache, DEFAULT_CACHE_DIR as DEFAULT_MESH_CACHE_DIR
+from connectivity import analyze_connectivity
+from plan_cache import layer_hashes, load_plan, save_plan, plan_path
+from job_control import ProgressReporter, CancelToken, JobCancelled, TIMEOUT_EXIT_CODE
 
+# Inputs that already are voxel grids and skip the mesh stages
+VOXEL_GRID_EXTENSIONS = ('.binvox', '.npz')
+
+
+# Triangles kept per unit of target resolution squared when decimating; the
+# surface of a res^3 grid only has on the order of res^2 voxel faces
+TRIANGLES_PER_RES2 = 2
+# Vertex clustering cell sizes tried when decimating, in voxels
+DECIMATION_CELLS = (0.25, 0.35, 0.5, 0.7, 1.0)
+
+# Step 0a: Resolution-Aware Decimation (vertex clustering)
+def cluster_vertices(mesh, cell):
+    """
+    Merge the vertices of each `cell`-sized grid cell into their mean, with
+    their mean vertex color, and drop the faces that collapse.
+    """
+    vertices = np.asarray(mesh.vertices)
+    colors = np.asarray(mesh.visual.vertex_colors, dtype=np.float64)
+    cells = np.floor(vertices / cell).astype(np.int64)
+    _, cluster, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    cluster = cluster.ravel()
+
+    new_vertices = np.stack([np.bincount(cluster, vertices[:, i]) for i in range(3)], axis=1) / counts[:, None]
+    new_colors = np.stack([np.bincount(cluster, colors[:, i]) for i in range(4)], axis=1) / counts[:, None]
+
+    faces = cluster[mesh.faces]
+    keep = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])
+    faces = faces[keep]
+    # Drop faces that became duplicates of each other (same corners, any order)
+    _, unique_faces = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+    faces = faces[np.sort(unique_faces)]
+    return trimesh.Trimesh(vertices=new_vertices, faces=faces,
+                           vertex_colors=np.round(new_colors).astype(np.uint8), process=False)
+
+def decimate_for_resolution(mesh, resolution):
+    """
+    Simplify a mesh already scaled to voxel units to at most
+    TRIANGLES_PER_RES2 * resolution^2 triangles, using the finest clustering
+    cell from DECIMATION_CELLS that meets the budget.
+    """
+    budget = TRIANGLES_PER_RES2 * resolution ** 2
+    if len(mesh.faces) <= budget:
+        return mesh
+    for cell in DECIMATION_CELLS:
+        decimated = cluster_vertices(mesh, cell)
+        if len(decimated.faces) <= budget:
+            break
+    return decimated
+
+def voxel_iou(a, b):
+    """Intersection over union of two occupancy grids (padded to a common shape)."""
+    shape = np.maximum(a.shape, b.shape)
+    pa = np.zeros(shape, dtype=bool)
+    pb = np.zeros(shape, dtype=bool)
+    pa[tuple(slice(0, n) for n in a.shape)] = a != 0
+    pb[tuple(slice(0, n) for n in b.shape)] = b != 0
+    union = np.logical_or(pa, pb).sum()
+    return np.logical_and(pa, pb).sum() / union if union else 1.0
+
+# Step 0c: Resolution Estimation from Low-Resolution Samples
+# The conversion is run at these resolutions to fit how its costs grow
+ESTIMATE_SAMPLE_RESOLUTIONS = (32, 64)
+CANDIDATE_RESOLUTIONS = (32, 48, 64, 80, 96, 128, 160, 192, 256)
+# Bytes allocated per grid cell at the peak: occupancy, interior and color
+# grids plus labeling and fill temporaries
+BYTES_PER_CELL = 32
+
+def _grid_cells(extents, resolution):
+    # Grid shape after rescale_obj_uniform: the longest side spans `resolution`
+    shape = np.round(np.asarray(extents) / max(extents) * resolution) + 1
+    return int(np.prod(shape))
+
+def _run_stages(mesh, resolution):
+    # All conversion stages on a rescaled copy; returns (voxels, bricks)
+    voxels, color_grid = voxelize_mesh_solid(mesh, workers=1, with_colors=True)
+    voxels, interior_voxels = prepare_voxel_grids(voxels)
+    plan = place_bricks_in_layers(interior_voxels, max_layers=resolution)
+    assign_colors_from_grid(plan, color_grid)
+    return int(np.count_nonzero(interior_voxels)), sum(len(layer['bricks']) for layer in plan)
+
+def _sample_conversion(mesh, resolution, measure_memory=False):
+    """
+    Run all conversion stages at `resolution`; returns (voxels, bricks,
+    seconds, peak bytes or None). tracemalloc slows the stages down about
+    2x, so the peak is measured in a second, untimed pass.
+    """
+    _, mesh = rescale_obj_uniform(None, None, target_dims=(resolution,) * 3, mesh=mesh.copy())
+    start = time.perf_counter()
+    voxels, bricks = _run_stages(mesh, resolution)
+    seconds = time.perf_counter() - start
+    peak = None
+    if measure_memory:
+        tracemalloc.start()
+        try:
+            _run_stages(mesh, resolution)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return voxels, bricks, seconds, peak
+
+def _volume_surface_fit(low, high, r_low, r_high):
+    # (a, b) with count = a*r^3 + b*r^2 through both samples: volume plus
+    # surface growth, so both bulky and thin shapes extrapolate well
+    a, b = np.linalg.solve([[r_low ** 3, r_low ** 2], [r_high ** 3, r_high ** 2]], [low, high])
+    if a < 0:
+        return 0.0, high / r_high ** 2
+    if b < 0:
+        return high / r_high ** 3, 0.0
+    return a, b
+
+def estimate_conversion_costs(mesh, resolutions=CANDIDATE_RESOLUTIONS):
+    """
+    Predict the filled voxel count, brick count, runtime (s) and peak
+    allocated memory (bytes) of converting `mesh` at each resolution.
+
+    The conversion is sampled at ESTIMATE_SAMPLE_RESOLUTIONS and extrapolated
+    as follows:
+    - voxels: a*r^3 + b*r^2 through both samples (volume plus surface)
+    - bricks: voxels times the bricks per voxel of the larger sample
+    - runtime: linear in grid cells, since placement scans every cell of
+      every layer's bounding box and dominates
+    - memory: the larger sample's fixed allocations plus BYTES_PER_CELL per
+      grid cell
+    The samples run single-process, so runtimes are an upper bound for grids
+    large enough to use the voxelization pool.
+    """
+    r_low, r_high = ESTIMATE_SAMPLE_RESOLUTIONS
+    voxels_low, _, seconds_low, _ = _sample_conversion(mesh, r_low)
+    voxels_high, bricks_high, seconds_high, peak_high = _sample_conversion(mesh, r_high, measure_memory=True)
+    extents = mesh.extents
+    cells_low, cells_high = _grid_cells(extents, r_low), _grid_cells(extents, r_high)
+
+    a, b = _volume_surface_fit(voxels_low, voxels_high, r_low, r_high)
+    bricks_per_voxel = bricks_high / voxels_high if voxels_high else 0.0
+    seconds_per_cell = max(0.0, (seconds_high - seconds_low) / (cells_high - cells_low))
+    fixed_seconds = max(0.0, seconds_high - seconds_per_cell * cells_high)
+    # Allocations that don't grow with the grid (mesh arrays, ray batches)
+    base_bytes = max(0, peak_high - BYTES_PER_CELL * cells_high)
+
+    estimates = []
+    for resolution in resolutions:
+        voxels = a * resolution ** 3 + b * resolution ** 2
+        cells = _grid_cells(extents, resolution)
+        estimates.append({
+            'resolution': resolution,
+            'voxels': int(voxels),
+            'bricks': int(voxels * bricks_per_voxel),
+            'seconds': fixed_seconds + seconds_per_cell * cells,
+            'peak_bytes': base_bytes + BYTES_PER_CELL * cells,
+        })
+    return estimates
+
+def choose_resolution(estimates, time_budget=None, memory_budget=None):
+    """
+    Highest estimated resolution within the time budget (s) and memory
+    budget (bytes), or the lowest one when none fits.
+    """
+    fitting = [e for e in estimates
+               if (time_budget is None or e['seconds'] <= time_budget)
+               and (memory_budget is None or e['peak_bytes'] <= memory_budget)]
+    if not fitting:
+        return min(e['resolution'] for e in estimates)
+    return max(e['resolution'] for e in fitting)
 
 # Step 0: Uniform Rescale with Centering and Vertex Color Extraction
-def rescale_obj_uniform(input_path, output_path, target_dims=(64, 64, 64)):
-    mesh = trimesh.load(input_path, force='mesh')
+def rescale_obj_uniform(input_path, output_path, target_dims=(64, 64, 64), mesh=None, decimate=False):
+    if mesh is None:  # a preloaded (e.g. cached) mesh skips loading input_path
+        mesh = trimesh.load(input_path, force='mesh')
     bounds = mesh.bounds
     scale_factors = np.array(target_dims) / (bounds[1] - bounds[0])
     uniform_scale = min(scale_factors)
@@ -19,17 +195,281 @@ def rescale_obj_uniform(input_path, output_path, target_dims=(64, 64, 64)):
     new_bounds = mesh.bounds
     translation = (np.array(target_dims) - (new_bounds[1] - new_bounds[0])) / 2 - new_bounds[0]
     mesh.apply_translation(translation)
-    mesh.export(output_path)
+    if decimate:
+        # In voxel units now, so the triangle budget follows the resolution
+        mesh = decimate_for_resolution(mesh, max(target_dims))
+    if output_path is not None:  # None when only the in-memory mesh is needed
+        mesh.export(output_path)
     return output_path, mesh  # Return mesh to access vertices and colors later
 
-# Step 1: Trimesh-based Voxelization
-def voxelize_obj_trimesh(path, pitch=1.0):
+# Step 1: Solid Voxelization (ray parity, in z slabs)
+# Rays are nudged off the integer grid so they don't run exactly through
+# shared edges or vertices, which would count one crossing twice
+RAY_JITTER = (1.234e-6, 2.345e-6)
+# Upper bound on (triangle, ray) candidates processed per batch
+RAY_BATCH_SIZE = 1 << 22
+# Grids smaller than this are voxelized in-process; pool startup would dominate
+PARALLEL_MIN_VOXELS = 1 << 22
+# In-process runs go slab by slab of about this many cells, checking for cancellation in between
+IN_PROCESS_SLAB_VOXELS = 1 << 19
+
+def _ray_hits(triangles, axis, origin, lo, hi, offset=0.0, barycentric=False):
+    """
+    Intersect the triangles with the rays parallel to `axis` through the
+    voxel centers (or, with offset=0.5, the voxel corners) whose integer
+    positions on the two other axes lie in [lo, hi). Returns (u, v, w): the
+    ray positions and the hit coordinate along `axis`, in voxel units. With
+    barycentric=True, also returns the hit triangles and the barycentric
+    coordinates (b1, b2) of the hits in them.
+    """
+    u_axis, v_axis = [a for a in range(3) if a != axis]
+    tu = triangles[:, :, u_axis] - origin[u_axis] - offset + RAY_JITTER[0]
+    tv = triangles[:, :, v_axis] - origin[v_axis] - offset + RAY_JITTER[1]
+    tw = triangles[:, :, axis] - origin[axis]
+
+    # Integer ray positions covered by each triangle's bounding box
+    u0 = np.maximum(np.ceil(tu.min(axis=1)), lo[u_axis]).astype(np.int64)
+    u1 = np.minimum(np.floor(tu.max(axis=1)), hi[u_axis] - 1).astype(np.int64)
+    v0 = np.maximum(np.ceil(tv.min(axis=1)), lo[v_axis]).astype(np.int64)
+    v1 = np.minimum(np.floor(tv.max(axis=1)), hi[v_axis] - 1).astype(np.int64)
+    nu = np.maximum(u1 - u0 + 1, 0)
+    nv = np.maximum(v1 - v0 + 1, 0)
+    candidates = nu * nv
+
+    us, vs, ws, tris, b1s, b2s = [], [], [], [], [], []
+    ends = np.cumsum(candidates)
+    start = 0
+    while start < len(triangles):
+        # Batch triangles so the candidate arrays stay bounded
+        base = ends[start - 1] if start else 0
+        stop = max(int(np.searchsorted(ends, base + RAY_BATCH_SIZE, side='right')), start + 1)
+        tri = np.repeat(np.arange(start, stop), candidates[start:stop])
+        k = np.arange(len(tri)) - np.repeat(ends[start:stop] - candidates[start:stop] - base, candidates[start:stop])
+        ru = u0[tri] + k // nv[tri]
+        rv = v0[tri] + k % nv[tri]
+
+        # 2D barycentric coordinates of the ray in the triangle's projection
+        au, av = tu[tri, 0], tv[tri, 0]
+        e1u, e1v = tu[tri, 1] - au, tv[tri, 1] - av
+        e2u, e2v = tu[tri, 2] - au, tv[tri, 2] - av
+        det = e1u * e2v - e2u * e1v
+        with np.errstate(divide='ignore', invalid='ignore'):
+            b1 = ((ru - au) * e2v - e2u * (rv - av)) / det
+            b2 = (e1u * (rv - av) - (ru - au) * e1v) / det
+            inside = (det != 0) & (b1 >= 0) & (b2 >= 0) & (b1 + b2 <= 1)
+
+        tri, b1, b2 = tri[inside], b1[inside], b2[inside]
+        us.append(ru[inside])
+        vs.append(rv[inside])
+        ws.append(tw[tri, 0] + b1 * (tw[tri, 1] - tw[tri, 0]) + b2 * (tw[tri, 2] - tw[tri, 0]))
+        tris.append(tri)
+        b1s.append(b1)
+        b2s.append(b2)
+        start = stop
+
+    if not us:
+        empty = np.zeros(0, dtype=np.int64)
+        hits = (empty, empty, np.zeros(0))
+        return hits + (empty, np.zeros(0), np.zeros(0)) if barycentric else hits
+    hits = (np.concatenate(us), np.concatenate(vs), np.concatenate(ws))
+    if barycentric:
+        hits += (np.concatenate(tris), np.concatenate(b1s), np.concatenate(b2s))
+    return hits
+
+def _voxelize_slab(triangles, origin, shape, z0, z1, triangle_colors=None):
+    """
+    Filled occupancy of grid[:, :, z0:z1]; see voxelize_mesh_solid. With
+    triangle_colors, returns (occupancy, RGBA colors) for the slab.
+    """
+    nx, ny, nz = shape
+    slab = np.zeros((nx, ny, z1 - z0), dtype=bool)
+    colors = np.zeros((nx, ny, z1 - z0, 4), dtype=np.uint8) if triangle_colors is not None else None
+
+    # Only triangles reaching the slab (plus half a voxel either side) matter
+    tz = triangles[:, :, 2] - origin[2]
+    near = (tz.min(axis=1) <= z1 + 0.5) & (tz.max(axis=1) >= z0 - 1.5)
+    triangles = triangles[near]
+    if len(triangles) == 0:
+        return slab if colors is None else (slab, colors)
+    if colors is not None:
+        triangle_colors = triangle_colors[near]
+        hit_cells, hit_colors = [], []
+
+    # Surface voxels: the four voxels around every corner ray crossing
+    for axis in range(3):
+        u_axis, v_axis = [a for a in range(3) if a != axis]
+        lo = [0, 0, max(z0 - 1, 0)]
+        hi = [nx, ny, z1]
+        u, v, w, tri, b1, b2 = _ray_hits(triangles, axis, origin, lo, hi, offset=0.5, barycentric=True)
+        if colors is not None:
+            # Vertex colors interpolated at the crossing
+            c = triangle_colors[tri]
+            rgb = c[:, 0] + b1[:, None] * (c[:, 1] - c[:, 0]) + b2[:, None] * (c[:, 2] - c[:, 0])
+        index = [None, None, None]
+        index[axis] = np.clip(np.round(w).astype(np.int64), 0, shape[axis] - 1)
+        for du in (0, 1):
+            for dv in (0, 1):
+                index[u_axis] = np.minimum(u + du, shape[u_axis] - 1)
+                index[v_axis] = np.minimum(v + dv, shape[v_axis] - 1)
+                keep = (index[2] >= z0) & (index[2] < z1)
+                slab[index[0][keep], index[1][keep], index[2][keep] - z0] = True
+                if colors is not None:
+                    hit_cells.append(np.ravel_multi_index(
+                        (index[0][keep], index[1][keep], index[2][keep] - z0), slab.shape))
+                    hit_colors.append(rgb[keep])
+
+    if colors is not None and hit_cells:
+        # Every surface voxel gets the mean color of the crossings around it
+        cells, cell_of_hit = np.unique(np.concatenate(hit_cells), return_inverse=True)
+        hit_colors = np.concatenate(hit_colors)
+        counts = np.bincount(cell_of_hit, minlength=len(cells))
+        flat = colors.reshape(-1, 4)
+        for channel in range(3):
+            sums = np.bincount(cell_of_hit, hit_colors[:, channel], minlength=len(cells))
+            flat[cells, channel] = np.round(sums / counts)
+        flat[cells, 3] = 255
+
+    # Parity fill between pairs of crossings on the x rays through the centers
+    y, z, x = _ray_hits(triangles, 0, origin, [0, 0, z0], [nx, ny, z1])
+    ray = y * nz + z
+    order = np.lexsort((x, ray))
+    ray, x = ray[order], x[order]
+    _, counts = np.unique(ray, return_counts=True)
+    closed = np.repeat(counts % 2 == 0, counts)
+    ray, x = ray[closed], x[closed]
+    i0 = np.clip(np.ceil(x[0::2]), 0, nx).astype(np.int64)
+    i1 = np.clip(np.floor(x[1::2]) + 1, 0, nx).astype(np.int64)
+    filled = i1 > i0
+    ray = ray[0::2][filled]
+    ray_y, ray_z = np.divmod(ray, nz)
+    row = ray_y * (z1 - z0) + (ray_z - z0)
+    # Difference array along x, summed into the occupied runs
+    delta = np.zeros((ny * (z1 - z0), nx + 1), dtype=np.int16)
+    np.add.at(delta, (row, i0[filled]), 1)
+    np.add.at(delta, (row, i1[filled]), -1)
+    inside = np.cumsum(delta[:, :nx], axis=1, dtype=np.int16) > 0
+    slab |= inside.reshape(ny, z1 - z0, nx).transpose(2, 0, 1)
+    return slab if colors is None else (slab, colors)
+
+# Mesh triangles shared once per pool worker by _init_voxel_worker
+_worker_mesh = None
+
+def _init_voxel_worker(triangles, origin, shape, triangle_colors=None):
+    global _worker_mesh
+    _worker_mesh = (triangles, origin, shape, triangle_colors)
+
+def _voxelize_worker_slab(bounds):
+    # Occupancy goes back to the parent bit-packed, 8 voxels per byte
+    triangles, origin, shape, triangle_colors = _worker_mesh
+    result = _voxelize_slab(triangles, origin, shape, *bounds, triangle_colors=triangle_colors)
+    if triangle_colors is None:
+        return binvox_rw.dense_to_packed(result)
+    slab, colors = result
+    return binvox_rw.dense_to_packed(slab), colors
+
+def _unpack_worker_slab(result):
+    if isinstance(result, tuple):
+        return binvox_rw.packed_to_dense(result[0]), result[1]
+    return binvox_rw.packed_to_dense(result)
+
+def voxelize_mesh_solid(mesh, pitch=1.0, workers=None, with_colors=False, cancel=None):
+    """
+    Voxelize a mesh into a filled occupancy grid in one pass.
+
+    Voxel centers sit on integer multiples of pitch, as with trimesh's
+    voxelizer. Rays along x through every voxel center are intersected with
+    all triangles in batch; pairs of sorted crossings bound the filled runs.
+    Surface voxels come from rays through the voxel corners along all three
+    axes, marking the four voxels around each corner, so thin and steep
+    features are kept like in a surface voxelization. Rays with an odd number
+    of crossings (open meshes) only keep their surface voxels. The grid is
+    close to, but not a superset of, trimesh's voxelized() plus interior
+    fill: each has voxels the other lacks (IoU 0.97 on a_banana.obj at
+    resolution 64 and 128, trimesh 5.1.1).
+
+    Every z slab only depends on the triangles that reach it, so large grids
+    are split into slabs voxelized by a pool of `workers` processes (default:
+    all cores) and stitched in order; the result doesn't depend on the number
+    of workers.
+
+    With with_colors=True, returns (grid, colors), where colors is an RGBA
+    uint8 grid of the same shape. Each surface voxel holds the mean of the
+    mesh vertex colors interpolated at the corner ray crossings around it,
+    i.e. at the surface points nearest to it; alpha is 0 for voxels without
+    a color (the filled inside).
+
+    The cancel token is checked after every slab, pooled or in-process, and
+    raises JobCancelled/JobTimeout; a partial grid is of no use downstream.
+    """
+    triangles = np.asarray(mesh.triangles, dtype=np.float64) / pitch
+    triangle_colors = None
+    if with_colors:
+        triangle_colors = np.asarray(mesh.visual.vertex_colors, dtype=np.float64)[mesh.faces][:, :, :3]
+    origin = np.round(triangles.reshape(-1, 3).min(axis=0))
+    shape = tuple(int(n) for n in np.round(triangles.reshape(-1, 3).max(axis=0)) - origin + 1)
+    nz = shape[2]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or np.prod(shape) < PARALLEL_MIN_VOXELS:
+        slab_size = max(1, IN_PROCESS_SLAB_VOXELS // (shape[0] * shape[1]))
+        slabs = []
+        for z0 in range(0, nz, slab_size):
+            if cancel is not None:
+                cancel.check()
+            slabs.append(_voxelize_slab(triangles, origin, shape, z0, min(z0 + slab_size, nz),
+                                        triangle_colors=triangle_colors))
+    else:
+        # A few slabs per worker keeps the pool busy when slab costs differ
+        slab_size = max(1, -(-nz // (workers * 4)))
+        bounds = [(z0, min(z0 + slab_size, nz)) for z0 in range(0, nz, slab_size)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_voxel_worker,
+                                 initargs=(triangles, origin, shape, triangle_colors)) as pool:
+            slabs = []
+            try:
+                for slab in pool.map(_voxelize_worker_slab, bounds):
+                    slabs.append(_unpack_worker_slab(slab))
+                    if cancel is not None:
+                        cancel.check()
+            except JobCancelled:
+                pool.shutdown(cancel_futures=True)
+                raise
+    if not with_colors:
+        return np.concatenate(slabs, axis=2).astype(int)
+    grid = np.concatenate([slab for slab, _ in slabs], axis=2)
+    colors = np.concatenate([slab_colors for _, slab_colors in slabs], axis=2)
+    return grid.astype(int), colors
+
+def voxelize_obj_trimesh(path, pitch=1.0, workers=None):
     mesh = trimesh.load(path, force='mesh')
-    voxelized = mesh.voxelized(pitch=pitch)
-    return voxelized.matrix.astype(int)
+    return voxelize_mesh_solid(mesh, pitch=pitch, workers=workers)
+
+# Step 1 (alternative): Load a Precomputed Voxel Grid (.binvox or .npz)
+def load_voxel_grid(path):
+    """
+    Load an occupancy grid indexed [x, y, z] with z as the layer axis.
+    .npz archives are read from their 'voxels' array (or the first array).
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.binvox':
+        # Decoded whole rather than with binvox_rw.SliceReader: connectivity
+        # bridging labels components across the full 3D grid, so placement
+        # can't start before every layer is in memory, and the int grid
+        # returned below dominates the peak either way
+        with open(path, 'rb') as f:
+            grid = binvox_rw.read_as_3d_array(f).data
+    elif ext == '.npz':
+        with np.load(path) as archive:
+            key = 'voxels' if 'voxels' in archive.files else archive.files[0]
+            grid = archive[key]
+    else:
+        raise ValueError(f"Unsupported voxel grid format: {ext}")
+    if grid.ndim != 3:
+        raise ValueError(f"Voxel grid must be 3D, got shape {grid.shape}")
+    return (grid != 0).astype(int)
 
 # Step 2: Ensure Connectivity (Minimal 1x1 Bridging)
-def connect_components_minimal(voxels):
+def connect_components_minimal(voxels, cancel=None):
     structure = np.ones((3, 3, 3), dtype=int)
     labeled, num_features = label(voxels, structure=structure)
     if num_features <= 1:
@@ -42,6 +482,10 @@ def connect_components_minimal(voxels):
     for label_id in range(1, num_features + 1):
         if label_id == main_label:
             continue
+        if cancel is not None and cancel.stop_requested():
+            # Out of time: leave the remaining components unbridged
+            cancel.degrade('prepare')
+            break
         other_coords = np.argwhere(labeled == label_id)
         min_dist = float('inf')
         best_pair = (None, None)
@@ -58,9 +502,12 @@ def connect_components_minimal(voxels):
     return voxels
 
 # Step 3: Create Interior Mask for Solid Structure
-def create_interior_mask(voxels):
+def create_interior_mask(voxels, cancel=None):
     mask = np.copy(voxels)
     for z in range(mask.shape[2]):
+        if cancel is not None:
+            # Placement needs every layer filled, so there is no partial result
+            cancel.check()
         mask[:, :, z] = binary_fill_holes(mask[:, :, z])
     return mask
 
@@ -105,23 +552,90 @@ def bounding_box(mask):
     return tuple(slice(min_, max_) for min_, max_ in zip(min_coords, max_coords))
 
 # Step 6: Process Voxel Layers
-def process_3d_voxel_fully_connected(voxels, max_layers=64):
-    voxels = connect_components_minimal(voxels)
-    interior_voxels = create_interior_mask(voxels)
-    z_layers = interior_voxels.shape[2]
+def prepare_voxel_grids(voxels, cancel=None):
+    # Steps 2-3: the mesh-dependent grids, cacheable independently of placement
+    voxels = connect_components_minimal(voxels, cancel=cancel)
+    interior_voxels = create_interior_mask(voxels, cancel=cancel)
+    return voxels, interior_voxels
+
+def place_layer(interior_voxels, z):
+    """Bricks for layer z, or None when the layer is empty."""
+    layer = interior_voxels[:, :, z]
+    bbox = bounding_box(layer)
+    if bbox is None or np.sum(layer[bbox]) == 0:
+        return None
+    return {'z': z, 'bricks': optimized_brick_placement_full_integrity(layer[bbox]), 'offset': bbox}
+
+def place_bricks_in_layers(interior_voxels, max_layers=64, progress=None, cancel=None):
+    z_layers = min(interior_voxels.shape[2], max_layers)
     all_bricks = []
-    for z in range(min(z_layers, max_layers)):
-        layer = interior_voxels[:, :, z]
-        bbox = bounding_box(layer)
-        if bbox is None:
-            continue
-        slice_mask = layer[bbox]
-        if np.sum(slice_mask) == 0:
-            continue
-        brick_plan = optimized_brick_placement_full_integrity(slice_mask)
-        all_bricks.append({'z': z, 'bricks': brick_plan, 'offset': bbox})
+    brick_count = 0
+    for z in range(z_layers):
+        if cancel is not None and cancel.stop_requested():
+            # Out of time: keep the layers placed so far (the bottom of the model)
+            cancel.degrade('place')
+            break
+        placed = place_layer(interior_voxels, z)
+        if placed is not None:
+            all_bricks.append(placed)
+            brick_count += len(placed['bricks'])
+        if progress is not None:
+            progress.layers(z + 1, z_layers, brick_count)
     return all_bricks
 
+def place_bricks_incrementally(interior_voxels, hashes, previous, progress=None, cancel=None):
+    """
+    Like place_bricks_in_layers over the layers in `hashes` (from
+    plan_cache.layer_hashes), but reusing the layers of a previous plan
+    (plan_cache.load_plan) whose mask hash is unchanged. Returns
+    (plan, uncolored layers, reused layer count): reused layers keep their
+    colors unless their color hash changed; the uncolored layers (a subset
+    of the plan's layer dicts) still need assign_colors_from_grid.
+    """
+    z_layers = len(hashes)
+    all_bricks, uncolored = [], []
+    brick_count = reused = 0
+    for z in range(z_layers):
+        if cancel is not None and cancel.stop_requested():
+            cancel.degrade('place')
+            break
+        mask_hash, color_hash = hashes[z]
+        old = previous.get(z)
+        if old is not None and old['mask'] == mask_hash:
+            reused += 1
+            if old['colors'] == color_hash:
+                placed = {'z': z, 'bricks': old['bricks'], 'offset': old['offset']}
+            else:
+                # Same bricks, new colors
+                placed = {'z': z, 'bricks': [brick[:4] for brick in old['bricks']], 'offset': old['offset']}
+                uncolored.append(placed)
+        else:
+            placed = place_layer(interior_voxels, z)
+            if placed is not None:
+                uncolored.append(placed)
+        if placed is not None:
+            all_bricks.append(placed)
+            brick_count += len(placed['bricks'])
+        if progress is not None:
+            progress.layers(z + 1, z_layers, brick_count)
+    return all_bricks, uncolored, reused
+
+def process_3d_voxel_fully_connected(voxels, max_layers=64, progress=None, cancel=None):
+    voxels, interior_voxels = prepare_voxel_grids(voxels, cancel=cancel)
+    return place_bricks_in_layers(interior_voxels, max_layers, progress=progress, cancel=cancel)
+
+def finish_or_stop(plan, cancel, on_timeout='partial'):
+    """
+    Decide what happens to a plan after placement when the job's deadline
+    has passed or it was cancelled: keep it as a partial result, or raise
+    JobCancelled/JobTimeout. Returns the plan.
+    """
+    if not cancel.stop_requested():
+        return plan
+    if cancel.cancelled or on_timeout == 'error' or not plan:
+        cancel.check()
+    return plan
+
 # Step 7: Save Brick Plan (.txt)
 def save_brick_plan(brick_layers, output_file):
     with open(output_file, 'w') as f:
@@ -133,12 +647,15 @@ def save_brick_plan(brick_layers, output_file):
                 f.write(f"  Brick at (x={j + x_offset}, y={i + y_offset}, z={z}) size=({bw}x{bh})\n")
 
 # Step 8: Save Aligned LDraw (.ldr) with Color Codes
+# LDraw part for each (rows, columns) brick footprint
+PART_IDS = {
+    (1, 1): '3005.dat', (1, 2): '3004.dat', (2, 1): '3004.dat',
+    (2, 2): '3003.dat', (2, 4): '3001.dat', (4, 2): '87079.dat',
+    (4, 1): '3010.dat', (1, 4): '3010.dat'
+}
+
 def save_ldr_file_vertical_flip_aligned(brick_layers, output_file):
-    part_id_map = {
-        (1, 1): '3005.dat', (1, 2): '3004.dat', (2, 1): '3004.dat',
-        (2, 2): '3003.dat', (2, 4): '3001.dat', (4, 2): '87079.dat',
-        (4, 1): '3010.dat', (1, 4): '3010.dat'
-    }
+    part_id_map = PART_IDS
     brick_height_ldu = 24
     brick_length_ldu = 20
     with open(output_file, 'w') as f:
@@ -175,6 +692,157 @@ def save_ldr_file_vertical_flip_aligned(brick_layers, output_file):
 #                 brick_id += 1
 
 
+# Expanded LEGO color palette (code, RGB in 0-1 range)
+LEGO_COLORS = [
+    (0, [0.1059, 0.1647, 0.2039]), # Black
+    (1, [0.1176, 0.3529, 0.6588]), # Blue
+    (2, [0.0000, 0.5216, 0.1686]), # Green
+    (3, [0.0235, 0.6157, 0.6235]), # Dark_Turquoise
+    (4, [0.7059, 0.0000, 0.0000]), # Red
+    (5, [0.8275, 0.2078, 0.6157]), # Dark_Pink
+    (6, [0.3294, 0.2000, 0.1412]), # Brown
+    (7, [0.5412, 0.5725, 0.5529]), # Light_Grey
+    (8, [0.3294, 0.3490, 0.3333]), # Dark_Grey
+    (9, [0.5922, 0.7961, 0.8510]), # Light_Blue
+    (10, [0.3451, 0.6706, 0.2549]), # Bright_Green
+    (11, [0.0000, 0.6667, 0.6431]), # Light_Turquoise
+    (12, [0.9412, 0.4275, 0.3804]), # Salmon
+    (13, [0.9647, 0.6627, 0.7333]), # Pink
+    (14, [0.9804, 0.7843, 0.0392]), # Yellow
+    (15, [0.9569, 0.9569, 0.9569]), # White
+    (16, [1.0000, 1.0000, 0.5020]), # Main_Colour
+    (17, [0.6784, 0.8510, 0.6588]), # Light_Green
+    (18, [1.0000, 0.8392, 0.4980]), # Light_Yellow
+    (19, [0.8431, 0.7294, 0.5490]), # Tan
+    (20, [0.6863, 0.7451, 0.8392]), # Light_Violet
+    (22, [0.4039, 0.1216, 0.5059]), # Purple
+    (23, [0.0549, 0.2431, 0.6039]), # Dark_Blue_Violet
+    (24, [0.4980, 0.4980, 0.4980]), # Edge_Colour
+    (25, [0.8392, 0.4745, 0.1373]), # Orange
+    (26, [0.5647, 0.1216, 0.4627]), # Magenta
+    (27, [0.6471, 0.7922, 0.0941]), # Lime
+    (28, [0.5373, 0.4902, 0.3843]), # Dark_Tan
+    (29, [1.0000, 0.6196, 0.8039]), # Bright_Pink
+    (30, [0.6275, 0.4314, 0.7255]), # Medium_Lavender
+    (31, [0.8039, 0.6431, 0.8706]), # Lavender
+    (65, [0.9804, 0.7843, 0.0392]), # Rubber_Yellow
+    (68, [0.9922, 0.7647, 0.5137]), # Very_Light_Orange
+    (69, [0.5412, 0.0706, 0.6588]), # Bright_Reddish_Lilac
+    (70, [0.3725, 0.1922, 0.0353]), # Reddish_Brown
+    (71, [0.5882, 0.5882, 0.5882]), # Light_Bluish_Grey
+    (72, [0.3922, 0.3922, 0.3922]), # Dark_Bluish_Grey
+    (73, [0.4510, 0.5882, 0.7843]), # Medium_Blue
+    (74, [0.4980, 0.7686, 0.4588]), # Medium_Green
+    (75, [0.0000, 0.0000, 0.0000]), # Speckle_Black_Copper
+    (76, [0.3882, 0.3725, 0.3804]), # Speckle_Dark_Bluish_Grey_Silver
+    (77, [0.9961, 0.8000, 0.8118]), # Light_Pink
+    (78, [1.0000, 0.7882, 0.5843]), # Light_Nougat
+    (79, [0.9333, 0.9333, 0.9333]), # Milky_White
+    (83, [0.0392, 0.0745, 0.1529]), # Pearl_Black
+    (84, [0.6667, 0.4902, 0.3333]), # Medium_Nougat
+    (85, [0.2667, 0.1020, 0.5686]), # Medium_Lilac
+    (86, [0.4824, 0.3647, 0.2549]), # Light_Brown
+    (89, [0.1098, 0.3451, 0.6549]), # Blue_Violet
+    (92, [0.7333, 0.5020, 0.3529]), # Nougat
+    (100, [0.9765, 0.7176, 0.6471]), # Light_Salmon
+    (110, [0.1490, 0.2745, 0.6039]), # Violet
+    (112, [0.2824, 0.3804, 0.6745]), # Medium_Violet
+    (115, [0.7176, 0.8314, 0.1451]), # Medium_Lime
+    (118, [0.6118, 0.8392, 0.8000]), # Aqua
+    (120, [0.8706, 0.9176, 0.5725]), # Light_Lime
+    (125, [0.9765, 0.6549, 0.4667]), # Light_Orange
+    (128, [0.6784, 0.3804, 0.2510]), # Dark_Nougat
+    (132, [0.0000, 0.0000, 0.0000]), # Speckle_Black_Silver
+    (133, [0.0000, 0.0000, 0.0000]), # Speckle_Black_Gold
+    (134, [0.4627, 0.3020, 0.2314]), # Copper
+    (135, [0.6275, 0.6275, 0.6275]), # Pearl_Light_Grey
+    (142, [0.8706, 0.6745, 0.4000]), # Pearl_Light_Gold
+    (147, [0.5137, 0.4471, 0.3098]), # Pearl_Dark_Gold
+    (148, [0.2824, 0.3020, 0.2824]), # Pearl_Dark_Grey
+    (150, [0.5961, 0.6078, 0.6000]), # Pearl_Very_Light_Grey
+    (151, [0.7843, 0.7843, 0.7843]), # Very_Light_Bluish_Grey
+    (176, [0.5804, 0.3176, 0.2824]), # Pearl_Red
+    (178, [0.6706, 0.4039, 0.2275]), # Pearl_Yellow
+    (179, [0.5373, 0.5294, 0.5333]), # Pearl_Silver
+    (183, [0.9647, 0.9490, 0.8745]), # Pearl_White
+    (187, [0.3412, 0.2235, 0.1725]), # Pearl_Brown
+    (189, [0.6745, 0.5098, 0.2784]), # Reddish_Gold
+    (191, [0.9882, 0.6745, 0.0000]), # Bright_Light_Orange
+    (212, [0.6157, 0.7647, 0.9686]), # Bright_Light_Blue
+    (216, [0.5294, 0.1686, 0.0902]), # Rust
+    (218, [0.5569, 0.3333, 0.5922]), # Reddish_Lilac
+    (219, [0.3373, 0.3059, 0.6157]), # Lilac
+    (226, [1.0000, 0.9255, 0.4235]), # Bright_Light_Yellow
+    (232, [0.4667, 0.7882, 0.8471]), # Sky_Blue
+    (256, [0.1059, 0.1647, 0.2039]), # Rubber_Black
+    (272, [0.0980, 0.1961, 0.3529]), # Dark_Blue
+    (273, [0.1176, 0.3529, 0.6588]), # Rubber_Blue
+    (288, [0.0000, 0.2706, 0.1020]), # Dark_Green
+    (295, [1.0000, 0.5804, 0.7608]), # Flamingo_Pink
+    (297, [0.6667, 0.4980, 0.1804]), # Pearl_Gold
+    (308, [0.2078, 0.1294, 0.0000]), # Dark_Brown
+    (313, [0.6706, 0.8510, 1.0000]), # Maersk_Blue
+    (320, [0.4471, 0.0000, 0.0706]), # Dark_Red
+    (321, [0.2745, 0.6078, 0.7647]), # Dark_Azure
+    (322, [0.4078, 0.7647, 0.8863]), # Medium_Azure
+    (323, [0.8275, 0.9490, 0.9176]), # Light_Aqua
+    (324, [0.7059, 0.0000, 0.0000]), # Rubber_Red
+    (326, [0.8863, 0.9765, 0.6039]), # Yellowish_Green
+    (330, [0.4667, 0.4667, 0.3059]), # Olive_Green
+    (335, [0.5333, 0.3765, 0.3686]), # Sand_Red
+    (350, [0.8392, 0.4745, 0.1373]), # Rubber_Orange
+    (351, [0.9686, 0.5216, 0.6941]), # Medium_Dark_Pink
+    (353, [1.0000, 0.4275, 0.4667]), # Coral
+    (366, [0.8471, 0.4275, 0.1725]), # Earth_Orange
+    (368, [0.9294, 1.0000, 0.1294]), # Neon_Yellow
+    (370, [0.4588, 0.3490, 0.2706]), # Medium_Brown
+    (371, [0.8000, 0.6392, 0.4510]), # Medium_Tan
+    (373, [0.4588, 0.3961, 0.4902]), # Sand_Purple
+    (375, [0.5412, 0.5725, 0.5529]), # Rubber_Light_Grey
+    (378, [0.4392, 0.5569, 0.4863]), # Sand_Green
+    (379, [0.4392, 0.5059, 0.6039]), # Sand_Blue
+    (402, [0.7922, 0.2980, 0.0431]), # Reddish_Orange
+    (406, [0.0980, 0.1961, 0.3529]), # Rubber_Dark_Blue
+    (422, [0.5686, 0.3608, 0.2353]), # Sienna_Brown
+    (423, [0.3294, 0.2471, 0.2000]), # Umber_Brown
+    (449, [0.4039, 0.1216, 0.5059]), # Rubber_Purple
+    (450, [0.8235, 0.4667, 0.2667]), # Fabuland_Brown
+    (462, [0.9608, 0.5255, 0.1412]), # Medium_Orange
+    (484, [0.5686, 0.3137, 0.1098]), # Dark_Orange
+    (490, [0.6471, 0.7922, 0.0941]), # Rubber_Lime
+    (493, [0.3961, 0.4039, 0.3804]), # Magnet
+    (494, [0.8157, 0.8157, 0.8157]), # Electric_Contact_Alloy
+    (495, [0.6824, 0.4784, 0.3490]), # Electric_Contact_Copper
+    (496, [0.5882, 0.5882, 0.5882]), # Rubber_Light_Bluish_Grey
+    (503, [0.7373, 0.7059, 0.6471]), # Very_Light_Grey
+    (504, [0.5373, 0.5294, 0.5333]), # Rubber_Flat_Silver
+    (507, [0.9804, 0.6118, 0.1098]), # Light_Orange_Brown
+    (508, [0.7765, 0.3176, 0.1529]), # Fabuland_Red
+    (509, [0.8118, 0.5412, 0.2784]), # Fabuland_Orange
+    (510, [0.4706, 0.9882, 0.4706]), # Fabuland_Lime
+    (511, [0.9569, 0.9569, 0.9569]), # Rubber_White
+    (10000, [0.9725, 0.9529, 0.8941]), # Fabric_Cream
+    (10002, [0.0000, 0.5216, 0.1686]), # Rubber_Green
+    (10010, [0.3451, 0.6706, 0.2549]), # Rubber_Bright_Green
+    (10019, [0.8431, 0.7294, 0.5490]), # Rubber_Tan
+    (10026, [0.5647, 0.1216, 0.4627]), # Rubber_Magenta
+    (10029, [1.0000, 0.6196, 0.8039]), # Rubber_Bright_Pink
+    (10030, [0.6275, 0.4314, 0.7255]), # Rubber_Medium_Lavender
+    (10031, [0.8039, 0.6431, 0.8706]), # Rubber_Lavender
+    (10070, [0.3725, 0.1922, 0.0353]), # Rubber_Reddish_Brown
+    (10072, [0.3922, 0.3922, 0.3922]), # Rubber_Dark_Bluish_Grey
+    (10073, [0.4510, 0.5882, 0.7843]), # Rubber_Medium_Blue
+    (10078, [1.0000, 0.7882, 0.5843]), # Rubber_Light_Nougat
+    (10226, [1.0000, 0.9255, 0.4235]), # Rubber_Bright_Light_Yellow
+    (10308, [0.2078, 0.1294, 0.0000]), # Rubber_Dark_Brown
+    (10320, [0.4471, 0.0000, 0.0706]), # Rubber_Dark_Red
+    (10321, [0.2745, 0.6078, 0.7647]), # Rubber_Dark_Azure
+    (10322, [0.4078, 0.7647, 0.8863]), # Rubber_Medium_Azure
+    (10323, [0.8275, 0.9490, 0.9176]), # Rubber_Light_Aqua
+    (10378, [0.4392, 0.5569, 0.4863]), # Rubber_Sand_Green
+    (10484, [0.5686, 0.3137, 0.1098]) # Rubber_Dark_Orange
+]
+
 def rgb_to_hsl(rgb):
     """Convert RGB (0-1 range) to HSL (H: 0-1, S: 0-1, L: 0-1)."""
     r, g, b = rgb
@@ -202,161 +870,18 @@ def get_lego_color_code(vertex_rgb, lego_colors, lego_hsl):
     min_idx = np.argmin(distances)
     return lego_colors[min_idx][0]
 
+# Palette in HSL, computed once per process
+LEGO_HSL = np.array([rgb_to_hsl(rgb) for code, rgb in LEGO_COLORS])
+
+@lru_cache(maxsize=None)
+def lego_color_code_rgb8(rgb8):
+    """Palette code for an (r, g, b) 0-255 tuple; memoized for the whole process."""
+    return get_lego_color_code(np.array(rgb8) / 255.0, LEGO_COLORS, LEGO_HSL)
+
 # Step 10
 def assign_colors_to_bricks(brick_layers, mesh):
-    # Expanded LEGO color palette (code, RGB in 0-1 range)
-    lego_colors = [
-        (0, [0.1059, 0.1647, 0.2039]), # Black
-        (1, [0.1176, 0.3529, 0.6588]), # Blue
-        (2, [0.0000, 0.5216, 0.1686]), # Green
-        (3, [0.0235, 0.6157, 0.6235]), # Dark_Turquoise
-        (4, [0.7059, 0.0000, 0.0000]), # Red
-        (5, [0.8275, 0.2078, 0.6157]), # Dark_Pink
-        (6, [0.3294, 0.2000, 0.1412]), # Brown
-        (7, [0.5412, 0.5725, 0.5529]), # Light_Grey
-        (8, [0.3294, 0.3490, 0.3333]), # Dark_Grey
-        (9, [0.5922, 0.7961, 0.8510]), # Light_Blue
-        (10, [0.3451, 0.6706, 0.2549]), # Bright_Green
-        (11, [0.0000, 0.6667, 0.6431]), # Light_Turquoise
-        (12, [0.9412, 0.4275, 0.3804]), # Salmon
-        (13, [0.9647, 0.6627, 0.7333]), # Pink
-        (14, [0.9804, 0.7843, 0.0392]), # Yellow
-        (15, [0.9569, 0.9569, 0.9569]), # White
-        (16, [1.0000, 1.0000, 0.5020]), # Main_Colour
-        (17, [0.6784, 0.8510, 0.6588]), # Light_Green
-        (18, [1.0000, 0.8392, 0.4980]), # Light_Yellow
-        (19, [0.8431, 0.7294, 0.5490]), # Tan
-        (20, [0.6863, 0.7451, 0.8392]), # Light_Violet
-        (22, [0.4039, 0.1216, 0.5059]), # Purple
-        (23, [0.0549, 0.2431, 0.6039]), # Dark_Blue_Violet
-        (24, [0.4980, 0.4980, 0.4980]), # Edge_Colour
-        (25, [0.8392, 0.4745, 0.1373]), # Orange
-        (26, [0.5647, 0.1216, 0.4627]), # Magenta
-        (27, [0.6471, 0.7922, 0.0941]), # Lime
-        (28, [0.5373, 0.4902, 0.3843]), # Dark_Tan
-        (29, [1.0000, 0.6196, 0.8039]), # Bright_Pink
-        (30, [0.6275, 0.4314, 0.7255]), # Medium_Lavender
-        (31, [0.8039, 0.6431, 0.8706]), # Lavender
-        (65, [0.9804, 0.7843, 0.0392]), # Rubber_Yellow
-        (68, [0.9922, 0.7647, 0.5137]), # Very_Light_Orange
-        (69, [0.5412, 0.0706, 0.6588]), # Bright_Reddish_Lilac
-        (70, [0.3725, 0.1922, 0.0353]), # Reddish_Brown
-        (71, [0.5882, 0.5882, 0.5882]), # Light_Bluish_Grey
-        (72, [0.3922, 0.3922, 0.3922]), # Dark_Bluish_Grey
-        (73, [0.4510, 0.5882, 0.7843]), # Medium_Blue
-        (74, [0.4980, 0.7686, 0.4588]), # Medium_Green
-        (75, [0.0000, 0.0000, 0.0000]), # Speckle_Black_Copper
-        (76, [0.3882, 0.3725, 0.3804]), # Speckle_Dark_Bluish_Grey_Silver
-        (77, [0.9961, 0.8000, 0.8118]), # Light_Pink
-        (78, [1.0000, 0.7882, 0.5843]), # Light_Nougat
-        (79, [0.9333, 0.9333, 0.9333]), # Milky_White
-        (83, [0.0392, 0.0745, 0.1529]), # Pearl_Black
-        (84, [0.6667, 0.4902, 0.3333]), # Medium_Nougat
-        (85, [0.2667, 0.1020, 0.5686]), # Medium_Lilac
-        (86, [0.4824, 0.3647, 0.2549]), # Light_Brown
-        (89, [0.1098, 0.3451, 0.6549]), # Blue_Violet
-        (92, [0.7333, 0.5020, 0.3529]), # Nougat
-        (100, [0.9765, 0.7176, 0.6471]), # Light_Salmon
-        (110, [0.1490, 0.2745, 0.6039]), # Violet
-        (112, [0.2824, 0.3804, 0.6745]), # Medium_Violet
-        (115, [0.7176, 0.8314, 0.1451]), # Medium_Lime
-        (118, [0.6118, 0.8392, 0.8000]), # Aqua
-        (120, [0.8706, 0.9176, 0.5725]), # Light_Lime
-        (125, [0.9765, 0.6549, 0.4667]), # Light_Orange
-        (128, [0.6784, 0.3804, 0.2510]), # Dark_Nougat
-        (132, [0.0000, 0.0000, 0.0000]), # Speckle_Black_Silver
-        (133, [0.0000, 0.0000, 0.0000]), # Speckle_Black_Gold
-        (134, [0.4627, 0.3020, 0.2314]), # Copper
-        (135, [0.6275, 0.6275, 0.6275]), # Pearl_Light_Grey
-        (142, [0.8706, 0.6745, 0.4000]), # Pearl_Light_Gold
-        (147, [0.5137, 0.4471, 0.3098]), # Pearl_Dark_Gold
-        (148, [0.2824, 0.3020, 0.2824]), # Pearl_Dark_Grey
-        (150, [0.5961, 0.6078, 0.6000]), # Pearl_Very_Light_Grey
-        (151, [0.7843, 0.7843, 0.7843]), # Very_Light_Bluish_Grey
-        (176, [0.5804, 0.3176, 0.2824]), # Pearl_Red
-        (178, [0.6706, 0.4039, 0.2275]), # Pearl_Yellow
-        (179, [0.5373, 0.5294, 0.5333]), # Pearl_Silver
-        (183, [0.9647, 0.9490, 0.8745]), # Pearl_White
-        (187, [0.3412, 0.2235, 0.1725]), # Pearl_Brown
-        (189, [0.6745, 0.5098, 0.2784]), # Reddish_Gold
-        (191, [0.9882, 0.6745, 0.0000]), # Bright_Light_Orange
-        (212, [0.6157, 0.7647, 0.9686]), # Bright_Light_Blue
-        (216, [0.5294, 0.1686, 0.0902]), # Rust
-        (218, [0.5569, 0.3333, 0.5922]), # Reddish_Lilac
-        (219, [0.3373, 0.3059, 0.6157]), # Lilac
-        (226, [1.0000, 0.9255, 0.4235]), # Bright_Light_Yellow
-        (232, [0.4667, 0.7882, 0.8471]), # Sky_Blue
-        (256, [0.1059, 0.1647, 0.2039]), # Rubber_Black
-        (272, [0.0980, 0.1961, 0.3529]), # Dark_Blue
-        (273, [0.1176, 0.3529, 0.6588]), # Rubber_Blue
-        (288, [0.0000, 0.2706, 0.1020]), # Dark_Green
-        (295, [1.0000, 0.5804, 0.7608]), # Flamingo_Pink
-        (297, [0.6667, 0.4980, 0.1804]), # Pearl_Gold
-        (308, [0.2078, 0.1294, 0.0000]), # Dark_Brown
-        (313, [0.6706, 0.8510, 1.0000]), # Maersk_Blue
-        (320, [0.4471, 0.0000, 0.0706]), # Dark_Red
-        (321, [0.2745, 0.6078, 0.7647]), # Dark_Azure
-        (322, [0.4078, 0.7647, 0.8863]), # Medium_Azure
-        (323, [0.8275, 0.9490, 0.9176]), # Light_Aqua
-        (324, [0.7059, 0.0000, 0.0000]), # Rubber_Red
-        (326, [0.8863, 0.9765, 0.6039]), # Yellowish_Green
-        (330, [0.4667, 0.4667, 0.3059]), # Olive_Green
-        (335, [0.5333, 0.3765, 0.3686]), # Sand_Red
-        (350, [0.8392, 0.4745, 0.1373]), # Rubber_Orange
-        (351, [0.9686, 0.5216, 0.6941]), # Medium_Dark_Pink
-        (353, [1.0000, 0.4275, 0.4667]), # Coral
-        (366, [0.8471, 0.4275, 0.1725]), # Earth_Orange
-        (368, [0.9294, 1.0000, 0.1294]), # Neon_Yellow
-        (370, [0.4588, 0.3490, 0.2706]), # Medium_Brown
-        (371, [0.8000, 0.6392, 0.4510]), # Medium_Tan
-        (373, [0.4588, 0.3961, 0.4902]), # Sand_Purple
-        (375, [0.5412, 0.5725, 0.5529]), # Rubber_Light_Grey
-        (378, [0.4392, 0.5569, 0.4863]), # Sand_Green
-        (379, [0.4392, 0.5059, 0.6039]), # Sand_Blue
-        (402, [0.7922, 0.2980, 0.0431]), # Reddish_Orange
-        (406, [0.0980, 0.1961, 0.3529]), # Rubber_Dark_Blue
-        (422, [0.5686, 0.3608, 0.2353]), # Sienna_Brown
-        (423, [0.3294, 0.2471, 0.2000]), # Umber_Brown
-        (449, [0.4039, 0.1216, 0.5059]), # Rubber_Purple
-        (450, [0.8235, 0.4667, 0.2667]), # Fabuland_Brown
-        (462, [0.9608, 0.5255, 0.1412]), # Medium_Orange
-        (484, [0.5686, 0.3137, 0.1098]), # Dark_Orange
-        (490, [0.6471, 0.7922, 0.0941]), # Rubber_Lime
-        (493, [0.3961, 0.4039, 0.3804]), # Magnet
-        (494, [0.8157, 0.8157, 0.8157]), # Electric_Contact_Alloy
-        (495, [0.6824, 0.4784, 0.3490]), # Electric_Contact_Copper
-        (496, [0.5882, 0.5882, 0.5882]), # Rubber_Light_Bluish_Grey
-        (503, [0.7373, 0.7059, 0.6471]), # Very_Light_Grey
-        (504, [0.5373, 0.5294, 0.5333]), # Rubber_Flat_Silver
-        (507, [0.9804, 0.6118, 0.1098]), # Light_Orange_Brown
-        (508, [0.7765, 0.3176, 0.1529]), # Fabuland_Red
-        (509, [0.8118, 0.5412, 0.2784]), # Fabuland_Orange
-        (510, [0.4706, 0.9882, 0.4706]), # Fabuland_Lime
-        (511, [0.9569, 0.9569, 0.9569]), # Rubber_White
-        (10000, [0.9725, 0.9529, 0.8941]), # Fabric_Cream
-        (10002, [0.0000, 0.5216, 0.1686]), # Rubber_Green
-        (10010, [0.3451, 0.6706, 0.2549]), # Rubber_Bright_Green
-        (10019, [0.8431, 0.7294, 0.5490]), # Rubber_Tan
-        (10026, [0.5647, 0.1216, 0.4627]), # Rubber_Magenta
-        (10029, [1.0000, 0.6196, 0.8039]), # Rubber_Bright_Pink
-        (10030, [0.6275, 0.4314, 0.7255]), # Rubber_Medium_Lavender
-        (10031, [0.8039, 0.6431, 0.8706]), # Rubber_Lavender
-        (10070, [0.3725, 0.1922, 0.0353]), # Rubber_Reddish_Brown
-        (10072, [0.3922, 0.3922, 0.3922]), # Rubber_Dark_Bluish_Grey
-        (10073, [0.4510, 0.5882, 0.7843]), # Rubber_Medium_Blue
-        (10078, [1.0000, 0.7882, 0.5843]), # Rubber_Light_Nougat
-        (10226, [1.0000, 0.9255, 0.4235]), # Rubber_Bright_Light_Yellow
-        (10308, [0.2078, 0.1294, 0.0000]), # Rubber_Dark_Brown
-        (10320, [0.4471, 0.0000, 0.0706]), # Rubber_Dark_Red
-        (10321, [0.2745, 0.6078, 0.7647]), # Rubber_Dark_Azure
-        (10322, [0.4078, 0.7647, 0.8863]), # Rubber_Medium_Azure
-        (10323, [0.8275, 0.9490, 0.9176]), # Rubber_Light_Aqua
-        (10378, [0.4392, 0.5569, 0.4863]), # Rubber_Sand_Green
-        (10484, [0.5686, 0.3137, 0.1098]) # Rubber_Dark_Orange
-    ]
-    lego_rgbs = np.array([rgb for code, rgb in lego_colors])
-    # Precompute HSL for LEGO colors
-    lego_hsl = np.array([rgb_to_hsl(rgb) for code, rgb in lego_colors])
+    lego_colors = LEGO_COLORS
+    lego_hsl = LEGO_HSL
 
     # Build KD-tree from mesh vertices
     vertices = mesh.vertices
@@ -385,57 +910,268 @@ def assign_colors_to_bricks(brick_layers, mesh):
 
     return brick_layers
 
-# Example Usage
-if __name__ == '__main__':
-    import sys
-    
-    if len(sys.argv) < 3:
-        print("Usage: python obj_to_ldr.py <obj_file_path> <output_ldr_path> [resolution]")
-        sys.exit(1)
+# Step 10b: Brick Colors from the Voxel Color Grid
+def assign_colors_from_grid(brick_layers, color_grid):
+    """
+    Color every brick with the mean color of the colored voxels it covers in
+    color_grid (RGBA from voxelize_mesh_solid). Bricks covering no colored
+    voxel, e.g. inside a solid layer, take the color of the nearest one.
+    """
+    footprints = [(layer['z'], layer['offset'][0].start + y_local, layer['offset'][1].start + x_local, bh, bw)
+                  for layer in brick_layers for y_local, x_local, bw, bh in layer['bricks']]
+    if not footprints:
+        return brick_layers
+    z, y0, x0, bh, bw = np.array(footprints, dtype=np.int64).T
+
+    # Brick id of every covered voxel, enumerated row by row within each brick
+    area = bh * bw
+    brick = np.repeat(np.arange(len(area)), area)
+    k = np.arange(len(brick)) - np.repeat(np.cumsum(area) - area, area)
+    cells = (y0[brick] + k // bw[brick], x0[brick] + k % bw[brick], z[brick])
+
+    colors = color_grid[cells]
+    colored = colors[:, 3] > 0
+    counts = np.bincount(brick[colored], minlength=len(area))
+    sums = np.stack([np.bincount(brick[colored], colors[colored, channel], minlength=len(area))
+                     for channel in range(3)], axis=1)
+    rgb = np.zeros((len(area), 3))
+    np.divide(sums, counts[:, None], out=rgb, where=counts[:, None] > 0)
+
+    uncolored = counts == 0
+    colored_voxels = np.argwhere(color_grid[..., 3] > 0)
+    if uncolored.any() and len(colored_voxels):
+        centers = np.stack([y0 + (bh - 1) / 2.0, x0 + (bw - 1) / 2.0, z], axis=1)[uncolored]
+        _, nearest = KDTree(colored_voxels).query(centers)
+        rgb[uncolored] = color_grid[tuple(colored_voxels[nearest].T)][:, :3]
+
+    # Match each distinct brick color to the palette once
+    unique_rgb, color_of_brick = np.unique(np.round(rgb).astype(np.uint8), axis=0, return_inverse=True)
+    codes = np.array([lego_color_code_rgb8(tuple(int(v) for v in c)) for c in unique_rgb])
+    codes = codes[color_of_brick.ravel()]
+
+    i = 0
+    for layer in brick_layers:
+        n = len(layer['bricks'])
+        layer['bricks'] = [(y_local, x_local, bw_, bh_, int(code))
+                           for (y_local, x_local, bw_, bh_), code in zip(layer['bricks'], codes[i:i + n])]
+        i += n
+    return brick_layers
+
+# Step 11: Convert One File
+def build_arg_parser():
+    arg_parser = argparse.ArgumentParser(description="Convert a mesh or voxel grid to an LDraw model")
+    arg_parser.add_argument('obj_file_path', help="obj (or any trimesh format), binvox or npz file")
+    arg_parser.add_argument('output_ldr_path')
+    arg_parser.add_argument('resolution', nargs='?', type=int, default=64)
+    arg_parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                            help="directory of cached voxel/interior grids")
+    arg_parser.add_argument('--mesh-cache-dir', default=DEFAULT_MESH_CACHE_DIR,
+                            help="directory of binary mesh files")
+    arg_parser.add_argument('--no-cache', action='store_true', help="don't use the voxel and mesh caches")
+    arg_parser.add_argument('--decimate', action='store_true',
+                            help="simplify the mesh to a triangle budget based on the resolution")
+    arg_parser.add_argument('--check-decimation', action='store_true',
+                            help="with --decimate, also voxelize the full mesh and report the voxel IoU")
+    arg_parser.add_argument('--workers', type=int, default=None,
+                            help="voxelization worker processes (default: all cores for large grids)")
+    arg_parser.add_argument('--progress-fd', type=int, default=None,
+                            help="file descriptor to write JSON-lines progress events to")
+    arg_parser.add_argument('--estimate', action='store_true',
+                            help="print estimated costs for resolutions up to the given one and exit")
+    arg_parser.add_argument('--time-budget', type=float, default=None,
+                            help="seconds; convert at the highest resolution estimated to fit")
+    arg_parser.add_argument('--memory-budget', type=float, default=None,
+                            help="MB; convert at the highest resolution estimated to fit")
+    arg_parser.add_argument('--save-plan', action='store_true',
+                            help="write <output>.plan.json with per-layer hashes for --incremental (meshes only)")
+    arg_parser.add_argument('--incremental', metavar='PREVIOUS_LDR', default=None,
+                            help="reuse the unchanged layers of an earlier conversion saved with --save-plan")
+    arg_parser.add_argument('--check-connectivity', action='store_true',
+                            help="report groups of placed bricks that don't hold together")
+    arg_parser.add_argument('--deadline', type=float, default=None,
+                            help="seconds the conversion may take before it winds down")
+    arg_parser.add_argument('--on-timeout', choices=('partial', 'error'), default='partial',
+                            help="at the deadline, save the layers placed so far or fail")
+    return arg_parser
+
+def convert_model(args, progress=None, cancel=None):
+    """
+    Convert args.obj_file_path to args.output_ldr_path with the options of
+    build_arg_parser(). Returns a summary dict: input, output, resolution,
+    layers, bricks, per-stage seconds and the stages cut short by the
+    deadline (or the cost estimates, with args.estimate). Raises
+    JobCancelled/JobTimeout when stopped without a usable result.
+    """
+    obj_file_path = args.obj_file_path
+    output_ldr_path = args.output_ldr_path
+    resolution = args.resolution
+    progress = progress if progress is not None else ProgressReporter()
+    cancel = cancel if cancel is not None else CancelToken(args.deadline)
+    summary = {'input': obj_file_path, 'output': output_ldr_path, 'resolution': resolution}
     
-    obj_file_path = sys.argv[1]
-    output_ldr_path = sys.argv[2]
-    resolution = 64
-    if len(sys.argv) > 3:
-        resolution = int(sys.argv[3])
+    print(f"Processing OBJ file: {obj_file_path}")
+    print(f"Output LDR path: {output_ldr_path}")
+    print(f"Resolution: {resolution}")
     
-    try:
-        print(f"Processing OBJ file: {obj_file_path}")
-        print(f"Output LDR path: {output_ldr_path}")
-        print(f"Resolution: {resolution}")
+    # Per-layer hashes for the plan sidecar (mesh inputs only)
+    hashes = None
+    if obj_file_path.lower().endswith(VOXEL_GRID_EXTENSIONS):
+        if args.estimate or args.time_budget is not None or args.memory_budget is not None:
+            # Estimates are sampled from the mesh; a grid has a fixed resolution
+            raise ValueError("--estimate, --time-budget and --memory-budget need a mesh input, "
+                             "not a voxel grid")
+        # Precomputed grid: skip mesh load, rescale and voxelization
+        with progress.stage('load'):
+            voxels = load_voxel_grid(obj_file_path)
+        print(f"Loaded voxel grid with shape: {voxels.shape}")
         
-        # Step 1: Rescale and center the model (with temp file for intermediate steps)
-        temp_obj_path = obj_file_path + ".rescaled.obj"
-        # Use the same resolution for height as for width and depth
-        scaled_path, mesh = rescale_obj_uniform(obj_file_path, temp_obj_path, target_dims=(resolution, resolution, resolution))
-        print("Mesh rescaled and centered")
+        # Without a mesh there are no vertex colors; bricks keep the default color
+        with progress.stage('prepare'):
+            voxels, interior_voxels = prepare_voxel_grids(voxels, cancel=cancel)
+        with progress.stage('place'):
+            plan_with_colors = place_bricks_in_layers(interior_voxels, max_layers=voxels.shape[2],
+                                                      progress=progress, cancel=cancel)
+        finish_or_stop(plan_with_colors, cancel, args.on_timeout)
+        print(f"Generated {len(plan_with_colors)} brick layers")
+    else:
+        voxel_cache = None
+        cached = None
+        mesh = None
+        with progress.stage('load'):
+            if not args.no_cache:
+                mesh_hash = file_sha256(obj_file_path)
+            
+            if args.estimate or args.time_budget is not None or args.memory_budget is not None:
+                # The resolution argument is the upper bound of the search
+                if not args.no_cache:
+                    mesh = MeshCache(args.mesh_cache_dir).load(obj_file_path, content_hash=mesh_hash)
+                else:
+                    mesh = trimesh.load(obj_file_path, force='mesh')
+                candidates = [r for r in CANDIDATE_RESOLUTIONS if r < resolution] + [resolution]
+                estimates = estimate_conversion_costs(mesh, candidates)
+                print(f"{'res':>5} {'voxels':>9} {'bricks':>8} {'seconds':>8} {'peak MB':>8}")
+                for e in estimates:
+                    print(f"{e['resolution']:>5} {e['voxels']:>9} {e['bricks']:>8} "
+                          f"{e['seconds']:>8.1f} {e['peak_bytes'] / 2**20:>8.1f}")
+                if args.estimate:
+                    summary['estimates'] = estimates
+                    return summary
+                memory_budget = args.memory_budget * 2**20 if args.memory_budget is not None else None
+                resolution = choose_resolution(estimates, args.time_budget, memory_budget)
+                print(f"Chosen resolution for the budget: {resolution}")
+            target_dims = (resolution, resolution, resolution)
+            
+            # The cache is checked before any mesh work: a hit needs neither the mesh nor its rescale
+            if not args.no_cache:
+                voxel_cache = VoxelCache(args.cache_dir)
+                cache_key = voxel_cache.key(mesh_hash, resolution, pitch=1.0, decimated=args.decimate)
+                cached = voxel_cache.load(cache_key)
+            cache_hit = cached is not None and cached[2] is not None
+            
+            if not cache_hit:
+                if mesh is None and not args.no_cache:
+                    mesh = MeshCache(args.mesh_cache_dir).load(obj_file_path, content_hash=mesh_hash)
+                # Step 1: Rescale and center the model (kept in memory, not re-read from disk)
+                # Use the same resolution for height as for width and depth
+                full_mesh = mesh.copy() if (mesh is not None and args.check_decimation) else None
+                _, mesh = rescale_obj_uniform(obj_file_path, None, target_dims=target_dims, mesh=mesh,
+                                              decimate=args.decimate)
+        if not cache_hit:
+            print("Mesh rescaled and centered")
+            if args.decimate:
+                print(f"Decimated mesh to {len(mesh.faces)} triangles")
+            if args.decimate and args.check_decimation:
+                _, full_mesh = rescale_obj_uniform(obj_file_path, None, target_dims=target_dims, mesh=full_mesh)
+                iou = voxel_iou(create_interior_mask(voxelize_mesh_solid(full_mesh, workers=args.workers)),
+                                create_interior_mask(voxelize_mesh_solid(mesh, workers=args.workers)))
+                print(f"Decimation voxel IoU: {iou:.4f}")
         
-        # Step 2: Voxelize the model
-        voxels = voxelize_obj_trimesh(scaled_path, pitch=1.0)
-        print(f"Voxelized model with shape: {voxels.shape}")
+        if cache_hit:
+            voxels, interior_voxels, color_grid = cached
+            print(f"Loaded cached voxel grids with shape: {voxels.shape}")
+        else:
+            # Step 2: Voxelize the model, sampling surface colors in the same pass
+            with progress.stage('voxelize'):
+                voxels, color_grid = voxelize_mesh_solid(mesh, pitch=1.0, workers=args.workers,
+                                                         with_colors=True, cancel=cancel)
+            print(f"Voxelized model with shape: {voxels.shape}")
+            
+            with progress.stage('prepare'):
+                voxels, interior_voxels = prepare_voxel_grids(voxels, cancel=cancel)
+            # Grids cut short by the deadline are not cached
+            if voxel_cache is not None and not cancel.degraded:
+                voxel_cache.store(cache_key, voxels, interior_voxels, color_grid)
         
         # Step 3: Process voxels to bricks
         # Use the same max layer count as resolution to ensure entire height is captured
-        plan = process_3d_voxel_fully_connected(voxels, max_layers=resolution)
+        previous = load_plan(plan_path(args.incremental)) if args.incremental else None
+        if args.save_plan or previous is not None:
+            hashes = layer_hashes(interior_voxels, color_grid, max_layers=resolution)
+        with progress.stage('place'):
+            if previous is not None:
+                plan, uncolored, reused = place_bricks_incrementally(interior_voxels, hashes, previous,
+                                                                     progress=progress, cancel=cancel)
+                summary['reused_layers'] = reused
+                print(f"Reused {reused} of {len(hashes)} layers from {args.incremental}")
+            else:
+                if args.incremental:
+                    print(f"No reusable plan for {args.incremental}; placing every layer")
+                plan = place_bricks_in_layers(interior_voxels, max_layers=resolution, progress=progress,
+                                              cancel=cancel)
+                uncolored = plan
+        finish_or_stop(plan, cancel, args.on_timeout)
         print(f"Generated {len(plan)} brick layers")
         
-        # Step 4: Assign colors to bricks
-        plan_with_colors = assign_colors_to_bricks(plan, mesh)
+        # Step 4: Assign colors to bricks (only the new or re-placed layers when incremental)
+        with progress.stage('color'):
+            assign_colors_from_grid(uncolored, color_grid)
+            plan_with_colors = plan
         print("Assigned colors to bricks")
-        
-        # Step 5: Save as LDR file
+    
+    if args.check_connectivity:
+        report = analyze_connectivity(plan_with_colors)
+        summary.update(groups=report['groups'], disconnected_bricks=report['disconnected_bricks'])
+        print(f"Connectivity: {report['bricks']} bricks in {report['groups']} connected groups; "
+              f"{report['disconnected_bricks']} outside the largest")
+        if report['groups'] > 1:
+            print(f"Warning: the model falls apart into {report['groups']} pieces "
+                  f"(sizes {', '.join(str(n) for n in report['group_sizes'][:10])})")
+    
+    if cancel.degraded:
+        print(f"Warning: deadline reached during {', '.join(cancel.degraded)}; saving a partial model")
+        progress.emit('partial', None, degraded=cancel.degraded)
+    
+    # Step 5: Save as LDR file
+    with progress.stage('save'):
         save_ldr_file_vertical_flip_aligned(plan_with_colors, output_ldr_path)
-        print(f"Saved LDR file to: {output_ldr_path}")
-        
-        # Clean up temporary files
-        if os.path.exists(temp_obj_path):
-            os.remove(temp_obj_path)
-            print("Cleaned up temporary files")
-        
+        if hashes is not None:
+            save_plan(plan_path(output_ldr_path), plan_with_colors, hashes)
+    print(f"Saved LDR file to: {output_ldr_path}")
+    
+    summary.update(resolution=resolution, layers=len(plan_with_colors),
+                   bricks=sum(len(layer['bricks']) for layer in plan_with_colors),
+                   timings=dict(progress.timings), degraded=list(cancel.degraded))
+    return summary
+
+# Example Usage
+if __name__ == '__main__':
+    args = build_arg_parser().parse_args()
+    progress = ProgressReporter.from_fd(args.progress_fd)
+    # SIGTERM stops the job at the next check instead of killing it mid-write
+    cancel = CancelToken(args.deadline)
+    cancel.cancel_on_signal()
+    
+    try:
+        convert_model(args, progress, cancel)
         print("Conversion complete!")
         sys.exit(0)
+    except JobCancelled as e:
+        progress.emit('error', None, message=str(e))
+        print(f"Error: {str(e)}")
+        sys.exit(TIMEOUT_EXIT_CODE)
     except Exception as e:
+        progress.emit('error', None, message=str(e))
         print(f"Error: {str(e)}")
         import traceback
         traceback.print_exc()
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
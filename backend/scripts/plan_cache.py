@@ -0,0 +1,74 @@
+# Per-layer brick plan sidecar for incremental conversion
+#
+# Next to an .ldr, <name>.ldr.plan.json keeps the brick plan together with a
+# hash of every layer's interior mask and color slice. A later conversion of
+# a similar grid (an improved mesh, a parameter tweak) re-places only the
+# layers whose mask hash changed and re-colors only those whose mask or
+# color hash changed; the rest are spliced in from the sidecar.
+
+import hashlib
+import json
+import numpy as np
+from cache_files import atomic_write
+
+# Bump when placement or coloring change so stale plans are not reused
+PLAN_CACHE_VERSION = 2
+
+
+def plan_path(ldr_path):
+    return ldr_path + '.plan.json'
+
+
+def _digest(shape, data):
+    # The shape is hashed explicitly: packed bits alone don't tell a 4x6 from a 6x4 layer
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr(tuple(shape)).encode())
+    digest.update(np.ascontiguousarray(data).tobytes())
+    return digest.hexdigest()
+
+
+def layer_hashes(interior_voxels, color_grid=None, max_layers=None):
+    """(mask hash, color hash) for every z layer placement would visit."""
+    z_layers = interior_voxels.shape[2] if max_layers is None else min(interior_voxels.shape[2], max_layers)
+    hashes = []
+    for z in range(z_layers):
+        mask = interior_voxels[:, :, z] != 0
+        colors = color_grid[:, :, z] if color_grid is not None else np.zeros(0, dtype=np.uint8)
+        hashes.append((_digest(mask.shape, np.packbits(mask)), _digest(colors.shape, colors)))
+    return hashes
+
+
+def save_plan(path, brick_layers, hashes):
+    """Write the plan and the hashes of its layers atomically."""
+    layers = []
+    for layer in brick_layers:
+        z = layer['z']
+        layers.append({
+            'z': z,
+            'mask': hashes[z][0],
+            'colors': hashes[z][1],
+            'offset': [[int(s.start), int(s.stop)] for s in layer['offset']],
+            'bricks': [[int(v) for v in brick] for brick in layer['bricks']],
+        })
+    with atomic_write(path, 'w') as f:
+        json.dump({'version': PLAN_CACHE_VERSION, 'layers': layers}, f)
+
+
+def load_plan(path):
+    """Layers of a saved plan keyed by z, or None if missing or stale."""
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if saved.get('version') != PLAN_CACHE_VERSION:
+        return None
+    layers = {}
+    for layer in saved['layers']:
+        layers[layer['z']] = {
+            'mask': layer['mask'],
+            'colors': layer['colors'],
+            'offset': tuple(slice(start, stop) for start, stop in layer['offset']),
+            'bricks': [tuple(brick) for brick in layer['bricks']],
+        }
+    return layers
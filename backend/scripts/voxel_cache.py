@@ -0,0 +1,78 @@
+# Persistent cache for the voxel stages of obj_to_ldr.py
+#
+# Voxelization, connectivity bridging and interior fill only depend on the
+# mesh, the resolution and the pitch, not on the brick set, shell mode or
+# palette. Their output grids are stored compressed on disk so re-placing or
+# re-coloring the same mesh skips the expensive geometry stages.
+
+import hashlib
+import os
+import tempfile
+import numpy as np
+from cache_files import atomic_write, evict_lru
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'LDR_VOXEL_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'model_to_ldr_voxel_cache'))
+DEFAULT_MAX_BYTES = int(os.environ.get('LDR_VOXEL_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# Bump when voxelization or interior fill change so stale grids are not reused
+VOXEL_STAGE_VERSION = 4
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Content hash of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class VoxelCache:
+    """
+    Directory of compressed .npz files holding (voxels, interior, colors) grids,
+    keyed by mesh content hash, resolution, pitch and whether the mesh was
+    decimated.
+
+    Entries are evicted least recently used first once the directory grows
+    past max_bytes; a cache hit refreshes the entry's modification time.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, mesh_hash, resolution, pitch=1.0, decimated=False):
+        suffix = "_d" if decimated else ""
+        return f"{mesh_hash}_r{resolution}_p{pitch:g}{suffix}_v{VOXEL_STAGE_VERSION}"
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def load(self, key):
+        """Return (voxels, interior, colors) for key, or None on a miss; colors may be None."""
+        path = self._path(key)
+        try:
+            with np.load(path) as archive:
+                voxels, interior = archive['voxels'], archive['interior']
+                colors = archive['colors'] if 'colors' in archive.files else None
+        except (OSError, KeyError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return voxels, interior, colors
+
+    def store(self, key, voxels, interior, colors=None):
+        """Write the grids atomically, then evict old entries if over budget."""
+        grids = {'voxels': voxels.astype(bool), 'interior': interior.astype(bool)}
+        if colors is not None:
+            grids['colors'] = colors
+        with atomic_write(self._path(key)) as f:
+            np.savez_compressed(f, **grids)
+        self.evict()
+
+    def evict(self):
+        evict_lru(self.cache_dir, self.max_bytes, '.npz')
@@ -85,6 +85,26 @@ function updateProgress(progress, status = null) {
   console.log(`Progress updated: ${progress}% - ${status || generationProgress.status}`)
 }
 
+/**
+ * Map LDR converter progress events onto a range of the overall progress
+ * @param {number} start - Overall progress when the conversion starts
+ * @param {number} end - Overall progress when the conversion ends
+ * @returns {Function} Progress callback for ModelToLDR.convertToLDR
+ */
+function conversionProgress(start, end) {
+  return (event) => {
+    // Errors are reported by the caller once the conversion settles
+    if (event.event === "error") return
+    let status = `Converting to LDR: ${event.stage}`
+    if (event.event === "layers") {
+      status += ` (layer ${event.done}/${event.total}, ${event.bricks} bricks)`
+    } else if (event.event === "partial") {
+      status = "Converting to LDR: deadline reached, keeping a partial model"
+    }
+    updateProgress(Math.round(start + (end - start) * event.progress), status)
+  }
+}
+
 /**
  * Create necessary directories if they don't exist
  */
@@ -764,6 +784,7 @@ app.post("/generate-ldr-from-image", async (req, res) => {
       updateProgress(65, "Converting 3D model to LDR format")
       const ldrResult = await modelToLdr.convertToLDR(modelResult.filePath, {
         resolution: req.body.options?.resolution || 80,
+        onProgress: conversionProgress(65, 75),
       })
       updateProgress(75, "LDR conversion successful")
 
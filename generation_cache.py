@@ -0,0 +1,85 @@
+"""
+Local cache of meshes generated by the text-to-3D endpoint
+
+A generation with a fixed seed is deterministic, so its result can be reused
+for identical (prompt, guidance_scale, num_steps, seed) requests to the same
+endpoint instead of spending minutes of remote GPU time again. Unseeded requests are never
+cached, since every call is meant to produce a new model.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unicodedata
+
+# Atomic writes and LRU eviction are shared with the converter's caches
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend", "scripts"))
+from cache_files import atomic_write, evict_lru
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "SHAPE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "shape_generation_cache"))
+DEFAULT_MAX_BYTES = int(os.environ.get("SHAPE_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+
+
+def normalize_prompt(prompt):
+    """
+    Canonical form of a prompt: Unicode NFC, case-folded, with runs of
+    whitespace collapsed. The text encoder lower-cases and splits on
+    whitespace anyway, so these variants generate the same model.
+    """
+    return " ".join(unicodedata.normalize("NFC", prompt).casefold().split())
+
+
+class GenerationCache:
+    """
+    Directory of generated mesh files keyed by the generation parameters,
+    evicted least recently used first once it grows past max_bytes.
+
+    Args:
+        cache_dir (str): Directory holding the cached meshes
+        max_bytes (int): Size budget of the directory
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, prompt, guidance_scale, num_steps, seed, endpoint, suffix=".stl"):
+        """
+        Cache key for a request, or None when the request isn't cacheable
+        (no seed). The endpoint is part of the key, so results of a local
+        stand-in are never served for the deployed app.
+        """
+        if seed is None:
+            return None
+        params = [normalize_prompt(prompt), float(guidance_scale), int(num_steps), int(seed), endpoint]
+        digest = hashlib.sha256(json.dumps(params).encode("utf-8")).hexdigest()
+        return digest + suffix
+
+    def fetch(self, key, output_file) -> bool:
+        """Copy the cached mesh for key to output_file; False on a miss."""
+        if key is None:
+            return False
+        path = os.path.join(self.cache_dir, key)
+        try:
+            shutil.copyfile(path, output_file)
+            os.utime(path)
+        except OSError:
+            return False
+        return True
+
+    def store(self, key, model_file):
+        """Copy a freshly generated mesh into the cache, then evict if over budget."""
+        if key is None:
+            return
+        with atomic_write(os.path.join(self.cache_dir, key)) as f, open(model_file, "rb") as src:
+            shutil.copyfileobj(src, f)
+        self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries until the total fits max_bytes."""
+        evict_lru(self.cache_dir, self.max_bytes)
@@ -0,0 +1,185 @@
+"""
+Text-to-LEGO job pipeline
+
+Prompts flow through two stages: remote mesh generation (network bound) and
+local conversion with backend/scripts/obj_to_ldr.py (CPU bound). The stages
+run concurrently, so the next models are generated while finished ones are
+converted. A bounded queue between the stages provides backpressure: when
+conversion falls behind, generators wait before starting new requests
+instead of piling up meshes.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from shape_client import ShapeClient, API_ENDPOINT, default_output_file, unique_file_names
+from generation_cache import GenerationCache, DEFAULT_CACHE_DIR
+
+CONVERTER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend", "scripts", "obj_to_ldr.py")
+
+
+class Job:
+    """One prompt's trip through the pipeline, with its stage timestamps."""
+
+    def __init__(self, prompt, mesh_file, ldr_file, guidance_scale=15.0, num_steps=64, seed=None):
+        self.prompt = prompt
+        self.mesh_file = mesh_file
+        self.ldr_file = ldr_file
+        self.guidance_scale = guidance_scale
+        self.num_steps = num_steps
+        self.seed = seed
+        self.error = None
+        self.submitted = None
+        self.generate_started = None
+        self.generated = None
+        self.convert_started = None
+        self.finished = None
+
+    def timings(self):
+        """Seconds spent generating, waiting for a converter, converting, and in total."""
+        def span(start, end):
+            return end - start if start is not None and end is not None else None
+        return {
+            "generate": span(self.generate_started, self.generated),
+            "queued": span(self.generated, self.convert_started),
+            "convert": span(self.convert_started, self.finished),
+            "total": span(self.submitted, self.finished),
+        }
+
+
+async def _generate_stage(client, pending, converted):
+    # Each generator takes the next job, generates it, and hands it over;
+    # put() blocks while the converters are behind
+    while pending:
+        job = pending.pop(0)
+        job.generate_started = time.perf_counter()
+        try:
+            ok = await client.generate(job.prompt, guidance_scale=job.guidance_scale, num_steps=job.num_steps,
+                                       seed=job.seed, output_file=job.mesh_file)
+            if not ok:
+                job.error = "generation failed"
+        except Exception as e:
+            # A failed job must not stop the generator or the batch
+            job.error = f"generation failed: {e}"
+        job.generated = time.perf_counter()
+        if job.error is not None:
+            job.finished = job.generated
+            continue
+        await converted.put(job)
+
+
+async def _convert_stage(converted, resolution, workers):
+    while True:
+        job = await converted.get()
+        if job is None:
+            return
+        job.convert_started = time.perf_counter()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, CONVERTER, job.mesh_file, job.ldr_file, str(resolution),
+                "--workers", str(workers),
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+            output, _ = await process.communicate()
+            if process.returncode != 0:
+                lines = output.decode(errors="replace").strip().splitlines()
+                job.error = lines[-1] if lines else f"converter exited with {process.returncode}"
+        except Exception as e:
+            # Keep this converter alive so the generators never wait on a dead queue
+            job.error = f"conversion failed: {e}"
+        job.finished = time.perf_counter()
+        print(f"{'Converted' if job.error is None else 'Failed'}: '{job.prompt}' -> {job.ldr_file}")
+
+
+async def run_pipeline(jobs, client, resolution=64, generators=4, converters=1, queue_size=2):
+    """
+    Run jobs through generation and conversion.
+
+    Args:
+        jobs (list[Job]): Jobs to run; their timestamps and errors are filled in
+        client (ShapeClient): Open client used for generation
+        resolution (int): Voxel resolution passed to the converter
+        generators (int): Generations in flight at once
+        converters (int): Conversion subprocesses running at once
+        queue_size (int): Generated meshes allowed to wait for a converter
+
+    Returns:
+        float: Wall-clock seconds for the whole batch
+    """
+    start = time.perf_counter()
+    # Latency counts from the start of the batch, including the wait for a free generator
+    for job in jobs:
+        job.submitted = start
+    pending = list(jobs)
+    converted = asyncio.Queue(maxsize=queue_size)
+    # Split the cores between the converters instead of each voxelizing on all of them
+    workers = max(1, (os.cpu_count() or 1) // converters)
+    convert_tasks = [asyncio.create_task(_convert_stage(converted, resolution, workers))
+                     for _ in range(converters)]
+    try:
+        await asyncio.gather(*(_generate_stage(client, pending, converted) for _ in range(generators)))
+    finally:
+        # Always release the converters, even when generation is interrupted
+        for _ in convert_tasks:
+            await converted.put(None)
+        await asyncio.gather(*convert_tasks)
+    return time.perf_counter() - start
+
+
+def report(jobs, elapsed):
+    """Print per-job stage latencies and the overall throughput."""
+    def fmt(seconds):
+        return f"{seconds:8.1f}" if seconds is not None else "       -"
+
+    print(f"{'generate':>8} {'queued':>8} {'convert':>8} {'total':>8}  job")
+    for job in jobs:
+        t = job.timings()
+        status = f"  ({job.error})" if job.error else ""
+        print(f"{fmt(t['generate'])} {fmt(t['queued'])} {fmt(t['convert'])} {fmt(t['total'])}  "
+              f"{job.prompt}{status}")
+    done = sum(job.error is None for job in jobs)
+    print(f"{done}/{len(jobs)} jobs done in {elapsed:.1f}s "
+          f"({done / elapsed * 60 if elapsed else 0.0:.2f} models/min)")
+
+
+async def main(args):
+    os.makedirs(args.output_dir, exist_ok=True)
+    jobs = []
+    # Distinct names even for prompts sharing a prefix or listed twice
+    params = [args.guidance_scale, args.num_steps, args.seed]
+    names = unique_file_names([default_output_file(prompt, suffix="", params=params) for prompt in args.prompts])
+    for prompt, name in zip(args.prompts, names):
+        jobs.append(Job(prompt, os.path.join(args.output_dir, name + ".stl"),
+                        os.path.join(args.output_dir, name + ".ldr"),
+                        guidance_scale=args.guidance_scale, num_steps=args.num_steps, seed=args.seed))
+
+    cache = None if args.no_cache else GenerationCache(args.cache_dir)
+    async with ShapeClient(args.endpoint, concurrency=args.generators, cache=cache) as client:
+        elapsed = await run_pipeline(jobs, client, resolution=args.resolution, generators=args.generators,
+                                     converters=args.converters, queue_size=args.queue_size)
+    report(jobs, elapsed)
+    return all(job.error is None for job in jobs)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Generate and convert LEGO models for several prompts")
+    arg_parser.add_argument("prompts", nargs="+")
+    arg_parser.add_argument("--output-dir", default=".")
+    arg_parser.add_argument("--resolution", type=int, default=64)
+    arg_parser.add_argument("--guidance-scale", type=float, default=15.0)
+    arg_parser.add_argument("--num-steps", type=int, default=64)
+    arg_parser.add_argument("--seed", type=int, default=None)
+    arg_parser.add_argument("--generators", type=int, default=4, help="generation requests in flight")
+    arg_parser.add_argument("--converters", type=int, default=os.cpu_count() or 1,
+                            help="conversion processes running at once")
+    arg_parser.add_argument("--queue-size", type=int, default=2,
+                            help="generated meshes allowed to wait for a converter")
+    arg_parser.add_argument("--endpoint", default=API_ENDPOINT)
+    arg_parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    arg_parser.add_argument("--no-cache", action="store_true")
+    args = arg_parser.parse_args()
+
+    if not asyncio.run(main(args)):
+        sys.exit(1)
@@ -0,0 +1,218 @@
+"""
+Async client for the deployed Modal text-to-3D app
+
+Runs many prompts concurrently over one pooled HTTP session and streams each
+generated STL straight to disk. The endpoint can be pointed at any server
+speaking the same protocol (POST with prompt/guidance_scale/num_steps/seed
+query parameters, mesh bytes in the response body), e.g. a local stand-in.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+
+import aiohttp
+
+from generation_cache import GenerationCache, DEFAULT_CACHE_DIR
+
+API_ENDPOINT = os.environ.get(
+    "SHAPE_API_ENDPOINT", "https://moulik-budhiraja--shape-text-to-3d-a100-40gb-generate.modal.run")
+
+REQUEST_TIMEOUT = 300  # seconds; generation takes minutes on the remote GPU
+CHUNK_SIZE = 64 * 1024
+MIN_MODEL_BYTES = 100  # anything smaller is an error message, not a mesh
+
+
+def default_output_file(prompt, suffix=".stl", params=None):
+    """
+    File name derived from the prompt, as in api-test.py. With `params` (the
+    other generation parameters) a short hash of the full prompt and the
+    parameters is appended, so prompts sharing their first 30 characters
+    don't write the same file.
+    """
+    safe_prompt = "".join(c if c.isalnum() else "_" for c in prompt)
+    if params is None:
+        return f"{safe_prompt[:30]}{suffix}"
+    digest = hashlib.sha256(json.dumps([prompt, *params]).encode("utf-8")).hexdigest()[:8]
+    return f"{safe_prompt[:30]}_{digest}{suffix}"
+
+
+def unique_file_names(names, taken=()):
+    """Number repeated names (model.stl, model-2.stl, ...), avoiding `taken` too."""
+    used = set(taken)
+    unique = []
+    for name in names:
+        base, ext = os.path.splitext(name)
+        candidate, n = name, 1
+        while candidate in used:
+            n += 1
+            candidate = f"{base}-{n}{ext}"
+        used.add(candidate)
+        unique.append(candidate)
+    return unique
+
+
+class ShapeClient:
+    """
+    Pooled async client for generate requests.
+
+    Use as an async context manager. At most `concurrency` generations run at
+    once; they share up to that many keep-alive connections. Seeded requests
+    found in `cache` are served from disk without a request.
+
+    Args:
+        endpoint (str): URL of the generate endpoint
+        concurrency (int): Maximum number of requests in flight
+        timeout (float): Total time allowed per request, in seconds
+        cache (GenerationCache, optional): Cache of seeded generations
+    """
+
+    def __init__(self, endpoint=API_ENDPOINT, concurrency=4, timeout=REQUEST_TIMEOUT, cache=None):
+        self.endpoint = endpoint
+        self.concurrency = concurrency
+        self.cache = cache
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session = None
+        self._slots = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+        self._session = None
+
+    async def generate(self, prompt, guidance_scale=15.0, num_steps=64, seed=None, output_file=None) -> bool:
+        """
+        Generate one model and stream it to output_file.
+
+        Args:
+            prompt (str): Text description of the 3D model
+            guidance_scale (float): Guidance scale for model generation
+            num_steps (int): Number of diffusion steps
+            seed (int, optional): Random seed for reproducibility
+            output_file (str, optional): Path to save the output STL file
+
+        Returns:
+            bool: True if generation was successful, False otherwise
+        """
+        params = {"prompt": prompt, "guidance_scale": guidance_scale, "num_steps": num_steps}
+        if seed is not None:
+            params["seed"] = seed
+        if output_file is None:
+            output_file = default_output_file(prompt, params=[guidance_scale, num_steps, seed])
+
+        cache_key = self.cache.key(prompt, guidance_scale, num_steps, seed, self.endpoint) if self.cache else None
+        if cache_key is not None and self.cache.fetch(cache_key, output_file):
+            print(f"Loaded cached 3D model for prompt: '{prompt}' into {output_file}")
+            return True
+
+        async with self._slots:
+            print(f"Generating 3D model for prompt: '{prompt}'")
+            try:
+                if not await self._download(params, output_file):
+                    return False
+                if cache_key is not None:
+                    self.cache.store(cache_key, output_file)
+                return True
+            except asyncio.TimeoutError:
+                print(f"Error: Request for '{prompt}' timed out. The model generation is taking too long.")
+            except aiohttp.ClientError as e:
+                print(f"Error: {e}")
+            return False
+
+    async def _download(self, params, output_file):
+        # Aiohttp wants str query values
+        query = {key: str(value) for key, value in params.items()}
+        async with self._session.post(self.endpoint, params=query) as response:
+            if response.status != 200:
+                print(f"Error: Received status code {response.status}")
+                print(f"Response: {await response.text()}")
+                return False
+
+            # Write to a temporary file so a failed download never leaves a partial model
+            temp_file = output_file + ".part"
+            size = 0
+            try:
+                with open(temp_file, "wb") as f:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        f.write(chunk)
+                        size += len(chunk)
+                if size < MIN_MODEL_BYTES:
+                    with open(temp_file, "rb") as f:
+                        print(f"Warning: Received very small file ({size} bytes)")
+                        print(f"Content: {f.read(100)}")
+                    return False
+                os.replace(temp_file, output_file)
+            finally:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+
+        print(f"Successfully saved 3D model to {output_file} ({size / 1024:.1f} KB)")
+        return True
+
+    async def generate_many(self, jobs):
+        """
+        Run generate() for every job concurrently. Jobs without an
+        output_file get distinct default names, numbered when the same
+        request appears more than once.
+
+        Args:
+            jobs (list[dict]): Keyword arguments for generate(), one dict per model
+
+        Returns:
+            list[bool]: Success of each job, in order
+
+        Raises:
+            ValueError: If two jobs name the same output_file
+        """
+        # Concurrent jobs writing one file would overwrite each other's downloads
+        explicit = [job["output_file"] for job in jobs if job.get("output_file") is not None]
+        if len(set(explicit)) != len(explicit):
+            raise ValueError("several jobs write the same output_file")
+        defaulted = [job for job in jobs if job.get("output_file") is None]
+        names = unique_file_names(
+            [default_output_file(job["prompt"], params=[job.get("guidance_scale", 15.0), job.get("num_steps", 64),
+                                                         job.get("seed")]) for job in defaulted],
+            taken=explicit)
+        jobs = [dict(job) for job in jobs]
+        named = iter(names)
+        for job in jobs:
+            if job.get("output_file") is None:
+                job["output_file"] = next(named)
+        return await asyncio.gather(*(self.generate(**job) for job in jobs))
+
+
+async def generate_3d_models(jobs, endpoint=API_ENDPOINT, concurrency=4, cache=None):
+    """Generate several models over one pooled session; see ShapeClient.generate_many."""
+    async with ShapeClient(endpoint, concurrency=concurrency, cache=cache) as client:
+        return await client.generate_many(jobs)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Generate 3D models for several prompts concurrently")
+    arg_parser.add_argument("prompts", nargs="+")
+    arg_parser.add_argument("--guidance-scale", type=float, default=15.0)
+    arg_parser.add_argument("--num-steps", type=int, default=64)
+    arg_parser.add_argument("--seed", type=int, default=None)
+    arg_parser.add_argument("--concurrency", type=int, default=4)
+    arg_parser.add_argument("--endpoint", default=API_ENDPOINT)
+    arg_parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                            help="directory of cached seeded generations")
+    arg_parser.add_argument("--no-cache", action="store_true", help="always call the endpoint")
+    args = arg_parser.parse_args()
+
+    jobs = [{"prompt": prompt, "guidance_scale": args.guidance_scale, "num_steps": args.num_steps,
+             "seed": args.seed} for prompt in args.prompts]
+    cache = None if args.no_cache else GenerationCache(args.cache_dir)
+    results = asyncio.run(generate_3d_models(jobs, endpoint=args.endpoint, concurrency=args.concurrency,
+                                             cache=cache))
+    print(f"{sum(results)}/{len(results)} models generated")
+    if not all(results):
+        sys.exit(1)